@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+A http client for cobot api which keeps connections alive in a pool, sets
+timeouts and retries failed requests with exponential backoff
+"""
+import time
+import random
+import threading
+import requests
+import config
+from requests.adapters import HTTPAdapter
+from logger import logger
+
+# status codes of response on which request is retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class CobotClient(object):
+    """
+    A thread safe client to send requests to cobot api
+    """
+
+    def __init__(self, token=None, url_str=None, pool_size=None,
+                 connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_factor=None, max_backoff=None):
+        self.url_str = url_str or config.MEMBERSHIPS_URL_STR
+        self.timeout = (connect_timeout or config.COBOT_CONNECT_TIMEOUT,
+                        read_timeout or config.COBOT_READ_TIMEOUT)
+        self.max_retries = config.COBOT_MAX_RETRIES if max_retries is None \
+            else max_retries
+        self.backoff_factor = backoff_factor or config.COBOT_BACKOFF_FACTOR
+        self.max_backoff = max_backoff or config.COBOT_MAX_BACKOFF
+
+        # a session keeps connections of a host alive in a pool, so that
+        # each request does not pay for a new TCP/TLS handshake
+        pool_size = pool_size or config.COBOT_POOL_SIZE
+        self.session = requests.Session()
+        for prefix in ('http://', 'https://'):
+            self.session.mount(prefix, HTTPAdapter(pool_connections=pool_size,
+                                                   pool_maxsize=pool_size))
+
+        # set Authorization header field
+        self.session.headers['Authorization'] = 'Bearer %s' % (
+            token or config.COBOT_TOKEN)
+
+        # latency stats of all requests sent by this client
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset latency stats of requests
+        """
+        with self._lock:
+            self.stats = {
+                'requests': 0,
+                'retries': 0,
+                'failures': 0,
+                'total_latency': 0.0,
+                'max_latency': 0.0
+            }
+
+    def _record(self, latency, retried=False, failed=False):
+        """
+        Record latency of a single request
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['retries'] += int(retried)
+            self.stats['failures'] += int(failed)
+            self.stats['total_latency'] += latency
+            self.stats['max_latency'] = max(self.stats['max_latency'],
+                                            latency)
+
+    def _get_backoff_time(self, attempt, response=None):
+        """
+        Return seconds to wait before next attempt, honors `Retry-After`
+        header of response otherwise backoff exponentially with full jitter
+        """
+        retry_after = response.headers.get('Retry-After') if response \
+            is not None else None
+
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff_factor * (2 ** attempt)))
+
+    def get(self, url, params=None, stream=False):
+        """
+        Send a GET request and return it's response, request is retried on
+        connection errors, timeouts and retryable status codes
+        """
+        attempt = 0
+
+        while True:
+            start_time = time.time()
+            response = None
+            try:
+                response = self.session.get(url, params=params,
+                                            timeout=self.timeout,
+                                            stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                latency = time.time() - start_time
+                retry = attempt < self.max_retries
+                self._record(latency, retried=retry, failed=not retry)
+                logger.warning("Request to {0} failed in {1:.3f}s with "
+                               "{2!r}".format(url, latency, e))
+                if not retry:
+                    raise
+            else:
+                latency = time.time() - start_time
+                retry = response.status_code in RETRY_STATUS_CODES and \
+                    attempt < self.max_retries
+                self._record(latency, retried=retry)
+                logger.debug("Request to {0} returned {1} in {2:.3f}s".format(
+                    url, response.status_code, latency))
+                if not retry:
+                    return response
+                # release connection back to pool before retrying
+                response.close()
+
+            backoff_time = self._get_backoff_time(attempt, response)
+            logger.info("Retrying request to {0} in {1:.2f}s (attempt {2} "
+                        "of {3})".format(url, backoff_time, attempt + 1,
+                                         self.max_retries))
+            time.sleep(backoff_time)
+            attempt += 1
+
+    def get_memberships(self, hub_name, date_str, stream=False):
+        """
+        Send a request to get memberships of a hub as of a given date
+        """
+        # set arbitrary arguments to be passed with request
+        params = {
+            'as_of': date_str
+        }
+        return self.get(self.url_str % hub_name, params=params, stream=stream)
+
+    def log_stats(self):
+        """
+        Log latency stats of all requests sent
+        """
+        with self._lock:
+            stats = dict(self.stats)
+
+        if not stats['requests']:
+            return
+
+        logger.info("Total {0} requests sent to cobot ({1} retried, {2} "
+                    "failed) with avg latency {3:.3f}s and max latency "
+                    "{4:.3f}s".format(stats['requests'], stats['retries'],
+                                      stats['failures'],
+                                      stats['total_latency'] /
+                                      stats['requests'],
+                                      stats['max_latency']))
+
+
+# a shared client instance to be used by all tasks
+cobot_client = CobotClient()
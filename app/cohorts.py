@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Cohort retention of memberships, memberships of a hub are grouped in cohorts
+by month they are confirmed in and type of their first plan, and members of
+each cohort still active at end of each later month are counted in bulk from
+their sorted canceled dates, materialized in `CohortRetention`
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy import func
+from app import db
+from app.models import Plan, HubPlan, Membership, MembershipPlan, \
+    CohortRetention
+from app.utils import get_current_date_obj
+
+
+def get_first_date_of_next_month(month_date):
+    """
+    Return first date of month next to a month of given date
+    """
+    return (month_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def get_first_plan_types_of_hub(hub):
+    """
+    Return a dictionary of type of first plan of each membership of a hub
+    """
+    query = db.session.query(MembershipPlan.membership_id, Plan.type).join(
+        HubPlan, MembershipPlan.hub_plan_id == HubPlan.id).join(
+        Plan, HubPlan.plan_id == Plan.id).filter(
+        HubPlan.hub_id == hub.id).order_by(
+        MembershipPlan.membership_id.desc(),
+        MembershipPlan.start_date.desc(),
+        MembershipPlan.id.desc())
+
+    # plans are ordered from last to first, so first plan is set at last
+    return dict(query.all())
+
+
+def iter_cohort_retention_of_hub(hub, e_date=None):
+    """
+    Yield cohort retention of a hub of every cohort and every month after it
+    till month of a given date one by one. If date is not passed, date of
+    last crawl of hub(or current date) is used, as memberships are not known
+    after it
+    """
+    e_date = e_date or hub.last_crawled_on or get_current_date_obj()
+    plan_types = get_first_plan_types_of_hub(hub)
+
+    # canceled dates of members of each cohort, None for active ones
+    cohorts = dict()
+
+    query = db.session.query(Membership.id, Membership.confirmed_at,
+                             Membership.canceled_to).filter(
+        Membership.hub_id == hub.id, Membership.confirmed_at != None)
+
+    for membership_id, confirmed_at, canceled_to in query:
+        key = (plan_types.get(membership_id, None),
+               confirmed_at.replace(day=1))
+        cohorts.setdefault(key, list()).append(canceled_to)
+
+    for (plan_type, cohort_date), canceled_dates in sorted(cohorts.items()):
+        member_count = len(canceled_dates)
+        canceled_dates = sorted(d for d in canceled_dates if d is not None)
+
+        period = 0
+        month_date = cohort_date
+        while month_date <= e_date:
+            next_month_date = get_first_date_of_next_month(month_date)
+
+            # members are active at end of month if they are not canceled
+            # before last date of month
+            yield {
+                'hub_id': hub.id,
+                'plan_type': plan_type,
+                'cohort_date': cohort_date,
+                'period': period,
+                'member_count': member_count,
+                'active_count': member_count - bisect_left(
+                    canceled_dates, next_month_date - timedelta(days=1))
+            }
+
+            period += 1
+            month_date = next_month_date
+
+
+def refresh_cohort_retention_of_hub(hub, e_date=None):
+    """
+    Replace cohort retention of a hub with freshly computed one, return count
+    of rows written
+    """
+    rows = list(iter_cohort_retention_of_hub(hub, e_date))
+
+    CohortRetention.query.filter(CohortRetention.hub_id == hub.id).delete(
+        synchronize_session=False)
+    db.session.bulk_insert_mappings(CohortRetention, rows)
+
+    # commit all changes, if commit is not deferred by a running unit of work
+    if not CohortRetention.is_commit_deferred():
+        CohortRetention.commit()
+
+    return len(rows)
+
+
+def get_cohort_retention(hub=None, plan_type=None):
+    """
+    Return a list of cohorts with their retention of a hub and plan type, of
+    all hubs and plan types if not passed
+    """
+    query = db.session.query(CohortRetention.cohort_date,
+                             CohortRetention.period,
+                             func.sum(CohortRetention.member_count),
+                             func.sum(CohortRetention.active_count)).group_by(
+        CohortRetention.cohort_date, CohortRetention.period).order_by(
+        CohortRetention.cohort_date, CohortRetention.period)
+
+    if hub is not None:
+        query = query.filter(CohortRetention.hub_id == hub.id)
+
+    if plan_type:
+        query = query.filter(CohortRetention.plan_type == plan_type)
+
+    cohorts = OrderedDict()
+    for cohort_date, period, member_count, active_count in query:
+        member_count = int(member_count or 0)
+        active_count = int(active_count or 0)
+
+        if cohort_date not in cohorts:
+            cohorts[cohort_date] = OrderedDict([
+                ('cohort', cohort_date.strftime('%Y-%m')),
+                ('member_count', member_count),
+                ('retention', list())
+            ])
+
+        cohorts[cohort_date]['retention'].append(OrderedDict([
+            ('period', period),
+            ('active_count', active_count),
+            ('percent', round(active_count * 100.0 / member_count, 1)
+             if member_count else 0.0)
+        ]))
+    return cohorts.values()
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Stores of dumped raw data of cobot api
+
+ * file - stores each dump as a plain file i.e <hub_name>/memberships-<date>.json
+ * gzip - stores each distinct dump once as a gzip compressed file named by
+          hash of it's content and keeps an index of dump names
+"""
+import os
+import gzip
+import hashlib
+import threading
+import config
+from contextlib import contextmanager
+from logger import logger
+
+
+class DumpStore(object):
+    """
+    Defines the general purpose functions of a dump store, a dump is
+    identified by a name in '<dir_name>/<file_name>' format
+    """
+
+    def exists(self, file_name):
+        """
+        Checks whether a dump exists or not
+        """
+        raise NotImplementedError
+
+    def open_to_read(self, file_name):
+        """
+        Return a file object to read raw data of a dump
+        """
+        raise NotImplementedError
+
+    def open_to_write(self, file_name):
+        """
+        Return a context manager which gives a file object to write raw data
+        of a dump, dump is stored only if whole block completes successfully
+        """
+        raise NotImplementedError
+
+    def iter_file_names(self):
+        """
+        Yield names of all dumps one by one
+        """
+        raise NotImplementedError
+
+    def remove(self, file_name):
+        """
+        Remove a dump from store
+        """
+        raise NotImplementedError
+
+    def get_total_size(self):
+        """
+        Return total size in bytes, all dumps take in store
+        """
+        raise NotImplementedError
+
+
+def get_total_size_of_dir(dir_path):
+    """
+    Return total size in bytes of all files within a directory
+    """
+    total_size = 0
+    for dir_path, dir_names, file_names in os.walk(dir_path):
+        for f_name in file_names:
+            total_size += os.path.getsize(os.path.join(dir_path, f_name))
+    return total_size
+
+
+class FileDumpStore(DumpStore):
+    """
+    Stores each dump as a plain file under a base directory
+    """
+
+    def __init__(self, basedir=None):
+        self.basedir = basedir or os.path.join(
+            config.DUMP_FOLDER_PATH or os.getcwd(), "dump")
+
+    def get_path(self, file_name):
+        """
+        Return absolute path of a dump file
+        """
+        f_path, f_name = file_name.rsplit("/", 1)
+        return os.path.join(self.basedir, f_path, f_name)
+
+    def exists(self, file_name):
+        return os.path.exists(self.get_path(file_name))
+
+    def open_to_read(self, file_name):
+        return open(self.get_path(file_name), 'rb')
+
+    @contextmanager
+    def open_to_write(self, file_name):
+        abs_file_path = self.get_path(file_name)
+
+        if not os.path.isdir(os.path.dirname(abs_file_path)):
+            os.makedirs(os.path.dirname(abs_file_path))
+
+        # data is written to a temporary file which is moved to dump file on
+        # success, so that a partially written dump is never left behind
+        tmp_file_path = abs_file_path + '.tmp'
+        completed = False
+        try:
+            with open(tmp_file_path, 'wb') as f:
+                yield f
+            os.rename(tmp_file_path, abs_file_path)
+            completed = True
+            logger.info("Data dumped to {0}".format(abs_file_path))
+        finally:
+            if not completed and os.path.exists(tmp_file_path):
+                os.remove(tmp_file_path)
+
+    def iter_file_names(self):
+        for dir_path, dir_names, file_names in os.walk(self.basedir):
+            dir_names.sort()
+            for f_name in sorted(file_names):
+                if f_name.endswith('.json'):
+                    yield os.path.relpath(os.path.join(dir_path, f_name),
+                                          self.basedir).replace(os.sep, '/')
+
+    def remove(self, file_name):
+        os.remove(self.get_path(file_name))
+
+    def get_total_size(self):
+        return get_total_size_of_dir(self.basedir)
+
+
+# hash of a line of index of compressed dump store, which marks a dump removed
+REMOVED_HASH = '-'
+
+
+class HashingWriter(object):
+    """
+    A file object wrapper which computes hash of all data written to it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha1()
+
+    def write(self, data):
+        self.hash.update(data)
+        self.f.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class CompressedDumpStore(DumpStore):
+    """
+    Stores each distinct dump once as a gzip compressed object named by sha1
+    hash of it's content, so that identical dumps of different days share
+    storage. An append only index file maps names of dumps to their hash,
+    i.e each line of index is '<file_name> <hash>', and a removed dump is
+    marked by a line '<file_name> -'
+    """
+
+    def __init__(self, basedir=None):
+        self.basedir = basedir or os.path.join(
+            config.DUMP_FOLDER_PATH or os.getcwd(), "store")
+        self.index_path = os.path.join(self.basedir, "index")
+        self.index = dict()
+        self._index_offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh_index(self):
+        """
+        Read lines appended to index file since it was read last time, it
+        must be called with lock held
+        """
+        if not os.path.exists(self.index_path) or \
+                os.path.getsize(self.index_path) <= self._index_offset:
+            return
+
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                # ignore a partially written last line
+                if not line.endswith('\n'):
+                    break
+                file_name, content_hash = line.split()
+                if content_hash == REMOVED_HASH:
+                    self.index.pop(file_name, None)
+                else:
+                    self.index[file_name] = content_hash
+                self._index_offset += len(line)
+
+    def _get_hash(self, file_name):
+        """
+        Return hash of content of a dump, if exists
+        """
+        with self._lock:
+            if file_name not in self.index:
+                self._refresh_index()
+            return self.index.get(file_name, None)
+
+    def get_object_path(self, content_hash):
+        """
+        Return absolute path of a compressed object of a given hash
+        """
+        return os.path.join(self.basedir, "objects", content_hash[:2],
+                            content_hash + '.json.gz')
+
+    def exists(self, file_name):
+        return self._get_hash(file_name) is not None
+
+    def open_to_read(self, file_name):
+        content_hash = self._get_hash(file_name)
+
+        if content_hash is None:
+            raise IOError("No dump found of {0}".format(file_name))
+
+        return gzip.open(self.get_object_path(content_hash), 'rb')
+
+    @contextmanager
+    def open_to_write(self, file_name):
+        tmp_dir_path = os.path.join(self.basedir, "tmp")
+
+        if not os.path.isdir(tmp_dir_path):
+            os.makedirs(tmp_dir_path)
+
+        # data is compressed to a temporary file while it's hash is computed
+        tmp_file_path = os.path.join(
+            tmp_dir_path, "%s.%d.json.gz" % (file_name.replace('/', '-'),
+                                             threading.current_thread().ident))
+        try:
+            with open(tmp_file_path, 'wb') as f:
+                gz_f = gzip.GzipFile(fileobj=f, mode='wb')
+                writer = HashingWriter(gz_f)
+                yield writer
+                gz_f.close()
+
+            content_hash = writer.hexdigest()
+            object_path = self.get_object_path(content_hash)
+
+            # store content only if an identical content is not stored yet
+            if os.path.exists(object_path):
+                logger.info("Data of {0} is identical to a dumped object "
+                            "{1}".format(file_name, content_hash))
+            else:
+                if not os.path.isdir(os.path.dirname(object_path)):
+                    os.makedirs(os.path.dirname(object_path))
+                os.rename(tmp_file_path, object_path)
+                logger.info("Data of {0} dumped to {1}".format(
+                    file_name, object_path))
+
+            with self._lock:
+                with open(self.index_path, 'ab') as f:
+                    f.write("%s %s\n" % (file_name, content_hash))
+                self.index[file_name] = content_hash
+        finally:
+            if os.path.exists(tmp_file_path):
+                os.remove(tmp_file_path)
+
+    def iter_file_names(self):
+        with self._lock:
+            self._refresh_index()
+            file_names = sorted(self.index)
+        return iter(file_names)
+
+    def remove(self, file_name):
+        with self._lock:
+            self._refresh_index()
+            content_hash = self.index.pop(file_name, None)
+
+            if content_hash is None:
+                raise IOError("No dump found of {0}".format(file_name))
+
+            with open(self.index_path, 'ab') as f:
+                f.write("%s %s\n" % (file_name, REMOVED_HASH))
+
+            # remove compressed object, if no other dump shares it
+            if content_hash not in self.index.values():
+                object_path = self.get_object_path(content_hash)
+                if os.path.exists(object_path):
+                    os.remove(object_path)
+
+    def get_total_size(self):
+        return get_total_size_of_dir(self.basedir)
+
+
+# all available types of dump stores
+DUMP_STORES = {
+    'file': FileDumpStore,
+    'gzip': CompressedDumpStore
+}
+
+_dump_store = None
+_dump_store_lock = threading.Lock()
+
+
+def get_dump_store():
+    """
+    Return a shared instance of dump store set in config
+    """
+    global _dump_store
+
+    with _dump_store_lock:
+        if _dump_store is None:
+            if config.DUMP_STORE not in DUMP_STORES:
+                raise ValueError("No such dump store %s" % config.DUMP_STORE)
+            _dump_store = DUMP_STORES[config.DUMP_STORE]()
+    return _dump_store
+
+
+def migrate_dump_store(source, target, remove=False):
+    """
+    Copy all dumps of source store which do not exist in target store, and
+    remove them from source store if `remove` is set. Return a count of
+    migrated dumps
+    """
+    cnt_of_dumps = 0
+
+    for file_name in source.iter_file_names():
+        if not target.exists(file_name):
+            with source.open_to_read(file_name) as src_f:
+                with target.open_to_write(file_name) as dst_f:
+                    while True:
+                        chunk = src_f.read(64 * 1024)
+                        if not chunk:
+                            break
+                        dst_f.write(chunk)
+            cnt_of_dumps += 1
+
+        if remove:
+            source.remove(file_name)
+
+    return cnt_of_dumps
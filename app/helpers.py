@@ -1,19 +1,38 @@
 # -*- coding: utf-8 -*-
 from flask import url_for
-from app import app
+from app import app, db
 from app.models import (Hub,
+                        Location,
                         Plan,
                         Time,
                         HubPlan,
                         Membership,
                         MembershipPlan,
                         MemberReport)
+from app.mixins import serialize_date, serialize_decimal
 from app.utils import (get_date_obj_from_str,
-                       decrement_date,
-                       get_current_date_obj,
                        get_first_date_of_month,
+                       get_last_date_of_month,
                        is_date_format_valid)
-from sqlalchemy import and_, or_
+from collections import OrderedDict
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload, contains_eager
+
+# columns of member reports grouped by each dimension of rollups
+REPORT_GROUP_BY_COLUMNS = OrderedDict([
+    ('hub', (Hub.name,)),
+    ('location', (Location.name,)),
+    ('plan_type', (Plan.type,)),
+    ('month', (Time.year, Time.month))
+])
+
+# count and revenue columns of member reports summed by rollups
+REPORT_SUM_COLUMNS = (MemberReport.new_member_count,
+                      MemberReport.retain_member_count,
+                      MemberReport.leave_member_count,
+                      MemberReport.new_member_revenue,
+                      MemberReport.retain_member_revenue,
+                      MemberReport.leave_member_revenue)
 
 # Function to easily find your assets
 # In your template use <link rel=stylesheet href="{{ static('filename') }}">
@@ -54,6 +73,53 @@ def preprocess_membership_data(membership_data):
     return res
 
 
+def get_membership_signature(membership_data):
+    """
+    Return a signature of a membership data, which changes only if data of
+    a membership that matters to processing changes
+    """
+    return (membership_data.get('plan', {}).get('name', "").strip(),
+            membership_data.get('canceled_to', None))
+
+
+def get_membership_signatures(data):
+    """
+    Return a dictionary of signatures of all memberships by their id
+    """
+    return dict((membership_data.get('id', None),
+                 get_membership_signature(membership_data))
+                for membership_data in data)
+
+
+def iter_changed_memberships(data, last_signatures, stats):
+    """
+    Yield only those memberships of data which are new or changed in
+    comparison of signatures of last processed data. `stats` dictionary is
+    filled with counts of new, changed, unchanged and removed memberships
+    """
+    for key in ('new', 'changed', 'unchanged', 'removed'):
+        stats[key] = 0
+
+    membership_ids = set()
+
+    for membership_data in data:
+        membership_id = membership_data.get('id', None)
+        membership_ids.add(membership_id)
+
+        last_signature = last_signatures.get(membership_id, None)
+
+        if last_signature is None:
+            stats['new'] += 1
+            yield membership_data
+        elif last_signature != get_membership_signature(membership_data):
+            stats['changed'] += 1
+            yield membership_data
+        else:
+            stats['unchanged'] += 1
+
+    stats['removed'] = len(set(last_signatures) - membership_ids)
+
+
 def is_membership_plan_changed(membership, hub_plan):
     """
     Check if a plan of a membership changed or not
@@ -82,95 +148,252 @@ def set_end_date_of_last_membership_plan(membership, end_date=None):
     return None
 
 
-def get_cnt_of_active_members_in_past(hub=None, days=0):
+def get_all_hub_plans_of_plan_type(hub=None, plan_type=None):
     """
-    Returns a number of active members in a hub on a given date
-    date should be in `YYYY-MM-DD` format.
+    Return all hub plans of a particular hub and whose plan is of given
+    plan_type, hub plans are loaded along with their plan, hub and location
+    of hub by a single query
     """
-    base_date = decrement_date(get_current_date_obj(), days=-days).isoformat()
+    query = and_()
 
-    query = or_(Membership.canceled_to == None,
-                Membership.canceled_to >= base_date)
+    if plan_type:
+        query = and_(query, Plan.type == plan_type)
 
-    # if hub's instance then return count of active members of a hub
     if isinstance(hub, Hub):
-        query = and_(Membership.hub == hub, query)
+        query = and_(query, HubPlan.hub_id == hub.id)
 
-    return int(Membership.count(query))
+    # hub plans are ordered by their plan, same as they are grouped by plan
+    return HubPlan.query.join(Plan, HubPlan.plan_id == Plan.id).options(
+        contains_eager(HubPlan.plan),
+        joinedload(HubPlan.hub).joinedload(Hub.location)).filter(
+        query).order_by(Plan.id, HubPlan.id).all()
 
 
-def get_cnt_of_new_members_in_past(hub=None, days=30):
+def get_all_member_reports_of_hub_plans(hub_plans, from_d=None, to_d=None,
+                                        granularity='month'):
     """
-    Returns a count of a new members in a given past days
+    Return all member reports of a granularity of given hub plans, whose
+    period starts within given months
     """
-    base_date = decrement_date(get_current_date_obj(), days=-days).isoformat()
-
-    query = and_(Membership.confirmed_at >= base_date)
-
-    # if hub's instance then return count of new members of a hub
-    if isinstance(hub, Hub):
-        query = and_(Membership.hub == hub, query)
-
-    return int(Membership.count(query))
-
-
-def get_cnt_of_leave_members_in_past(hub=None, days=30):
+    query = get_filter_of_member_reports(hub_plans, from_d, to_d, granularity)
+
+    # filter member reports by dates of their times joined on time_id,
+    # instead of a correlated subquery of each member report. Time and hub
+    # plan of each member report along with plan, hub and location of it are
+    # loaded by same query, so that serializing them queries nothing more
+    return MemberReport.query.join(
+        Time, MemberReport.time_id == Time.id).options(
+        contains_eager(MemberReport.time),
+        joinedload(MemberReport.hub_plan).joinedload(HubPlan.plan),
+        joinedload(MemberReport.hub_plan).joinedload(
+            HubPlan.hub).joinedload(Hub.location)).filter(query).all()
+
+
+def get_filter_of_member_reports(hub_plans, from_d=None, to_d=None,
+                                 granularity='month'):
     """
-    Returns a count of a leave members in a given past days
+    Return a condition of member reports of a granularity of given hub plans,
+    whose period starts within given months. Member reports must be joined
+    with their time
     """
-    base_date = decrement_date(get_current_date_obj(), days=-days).isoformat()
+    hub_plan_ids = [hp.id for hp in hub_plans if isinstance(hp, HubPlan)]
 
-    query = and_(Membership.canceled_to >= base_date)
+    query = and_(MemberReport.hub_plan_id.in_(hub_plan_ids),
+                 MemberReport.granularity == granularity)
 
-    # if hub's instance then return count of new members of a hub
-    if isinstance(hub, Hub):
-        query = and_(Membership.hub == hub, query)
+    if is_date_format_valid(from_d, '%Y-%m'):
+            date_str = get_first_date_of_month(from_d)
+            query = and_(query, Time.date >= date_str)
 
-    return int(Membership.count(query))
+    if is_date_format_valid(to_d, '%Y-%m'):
+            date_str = get_last_date_of_month(to_d)
+            query = and_(query, Time.date <= date_str)
 
+    return query
 
-def get_all_hub_plans_of_plan_type(hub=None, plan_type=None):
+
+def get_member_report_rows_of_hub_plans(hub_plans, from_d=None, to_d=None,
+                                        granularity='month', after=None,
+                                        limit=None):
     """
-    Return all hub plans of a particular hub and whose plan is of given
-    plan_type
+    Return a query of member reports same as
+    `get_all_member_reports_of_hub_plans`, but each member report is a plain
+    row of columns serialized by `serialize_member_report_row`, so that no
+    model instance is built at all
+
+    If `after` or `limit` is passed, member reports are ordered by their
+    time_id and hub_plan_id and only `limit` member reports after a cursor
+    `after` (i.e a tuple of time_id and hub_plan_id) are returned
     """
-    query = and_()
+    query = get_filter_of_member_reports(hub_plans, from_d, to_d, granularity)
+
+    if after is not None:
+        time_id, hub_plan_id = after
+        query = and_(query, or_(MemberReport.time_id > time_id,
+                                and_(MemberReport.time_id == time_id,
+                                     MemberReport.hub_plan_id > hub_plan_id)))
+
+    rows = db.session.query(MemberReport.time_id,
+                            MemberReport.hub_plan_id,
+                            MemberReport.new_member_count,
+                            MemberReport.retain_member_count,
+                            MemberReport.leave_member_count,
+                            MemberReport.new_member_revenue,
+                            MemberReport.retain_member_revenue,
+                            MemberReport.leave_member_revenue,
+                            MemberReport.granularity,
+                            Time.year,
+                            Time.month,
+                            Time.date,
+                            Hub.name,
+                            Location.id,
+                            Location.name,
+                            Plan.name,
+                            Plan.type,
+                            Plan.price).select_from(MemberReport).join(
+        Time, MemberReport.time_id == Time.id).join(
+        HubPlan, MemberReport.hub_plan_id == HubPlan.id).join(
+        Hub, HubPlan.hub_id == Hub.id).join(
+        Plan, HubPlan.plan_id == Plan.id).outerjoin(
+        Location, Hub.location_id == Location.id).filter(query)
+
+    if after is not None or limit is not None:
+        rows = rows.order_by(MemberReport.time_id, MemberReport.hub_plan_id)
+
+    if limit is not None:
+        rows = rows.limit(limit)
+    return rows
+
+
+def get_grouped_member_reports_of_hub_plans(hub_plans, group_by, from_d=None,
+                                            to_d=None, granularity='month'):
+    """
+    Return sums of counts and revenues of member reports same as
+    `get_all_member_reports_of_hub_plans`, grouped by given dimensions(i.e
+    hub, location, plan_type or month) and aggregated by a single query
+    """
+    query = get_filter_of_member_reports(hub_plans, from_d, to_d, granularity)
+
+    columns = list()
+    for name in group_by:
+        columns.extend(REPORT_GROUP_BY_COLUMNS[name])
+
+    rows = db.session.query(*(columns + [
+        func.sum(c) for c in REPORT_SUM_COLUMNS])).select_from(
+        MemberReport).join(
+        Time, MemberReport.time_id == Time.id).join(
+        HubPlan, MemberReport.hub_plan_id == HubPlan.id).join(
+        Hub, HubPlan.hub_id == Hub.id).join(
+        Plan, HubPlan.plan_id == Plan.id).outerjoin(
+        Location, Hub.location_id == Location.id).filter(query).group_by(
+        *columns).order_by(*columns)
 
-    if plan_type:
-        query = and_(Plan.type == plan_type)
+    res = list()
+    for row in rows:
+        values = list(row)
+        report = OrderedDict()
+
+        for name in group_by:
+            if name == 'month':
+                year, month = values.pop(0), values.pop(0)
+                report[name] = '%04d-%02d' % (year, month) \
+                    if year and month else None
+            else:
+                report[name] = values.pop(0)
+
+        for c, value in zip(REPORT_SUM_COLUMNS, values):
+            if c.key.endswith('_count'):
+                report[c.key] = int(value or 0)
+            else:
+                report[c.key] = serialize_decimal(value)
+
+        res.append(report)
+    return res
 
-    # get all plans of a given plan_type
-    plans = Plan.find(query)
 
-    res = list()
+def iter_member_report_rows_of_hub_plans(hub_plans, from_d=None, to_d=None,
+                                         granularity='month', after=None,
+                                         limit=None, batch_size=1000):
+    """
+    Yield rows of member reports same as `get_member_report_rows_of_hub_plans`
+    ordered by their cursor, rows are fetched in pages of `batch_size` rows
+    and each page is sought after last row of previous page. So that only a
+    page of rows is held in memory at once, even if database driver buffers
+    all rows of a query
+    """
+    while limit is None or limit > 0:
+        size = batch_size if limit is None else min(batch_size, limit)
+        rows = get_member_report_rows_of_hub_plans(
+            hub_plans, from_d, to_d, granularity, after, size).all()
 
-    for plan in plans:
-        query = and_(HubPlan.plan == plan)
+        for row in rows:
+            yield row
 
-        if isinstance(hub, Hub):
-            query = and_(query, HubPlan.hub == hub)
+        # last page, if it's not full
+        if len(rows) < size:
+            break
 
-        hub_plans = HubPlan.find(query)
-        res.extend(hub_plans)
-    return res
+        after = (rows[-1][0], rows[-1][1])
+        if limit is not None:
+            limit -= size
 
 
-def get_all_member_reports_of_hub_plans(hub_plans, from_d=None, to_d=None):
+def get_cursor_of_member_report_row(row):
     """
+    Return a cursor of a row of `get_member_report_rows_of_hub_plans`, to get
+    member reports after it, i.e '<time_id>-<hub_plan_id>'
     """
-    hub_plan_ids = [hp.id for hp in hub_plans if isinstance(hp, HubPlan)]
+    return '%d-%d' % (row[0], row[1])
 
-    query = and_(MemberReport.hub_plan_id.in_(hub_plan_ids))
 
-    if is_date_format_valid(from_d, '%Y-%m'):
-            date_str = get_first_date_of_month(from_d)
-            query = and_(query, MemberReport.time.has(Time.date >= date_str))
+def parse_cursor_of_member_reports(cursor):
+    """
+    Return a tuple of time_id and hub_plan_id of a cursor of member reports,
+    None if cursor is not valid
+    """
+    try:
+        time_id, hub_plan_id = [int(i) for i in cursor.split('-')]
+    except (ValueError, AttributeError):
+        return None
+    return time_id, hub_plan_id
 
-    if is_date_format_valid(to_d, '%Y-%m'):
-            date_str = get_first_date_of_month(to_d)
-            query = and_(query, MemberReport.time.has(Time.date <= date_str))
 
-    return MemberReport.find(query)
+def serialize_member_report_row(row):
+    """
+    Serialize a row of `get_member_report_rows_of_hub_plans` exactly as
+    `MemberReport.serialize` serializes a member report
+    """
+    (time_id, hub_plan_id, new_cnt, retain_cnt, leave_cnt, new_rev,
+     retain_rev, leave_rev, granularity, year, month, c_date, hub_name,
+     location_id, location_name, plan_name, plan_type, price) = row
+
+    hub = OrderedDict([
+        ('name', hub_name),
+        ('location', OrderedDict([('name', location_name)])
+         if location_id is not None else None)
+    ])
+
+    plan = OrderedDict([
+        ('name', plan_name),
+        ('type', plan_type),
+        ('price', serialize_decimal(price))
+    ])
+
+    return OrderedDict([
+        ('new_member_count', new_cnt),
+        ('retain_member_count', retain_cnt),
+        ('leave_member_count', leave_cnt),
+        ('new_member_revenue', serialize_decimal(new_rev)),
+        ('retain_member_revenue', serialize_decimal(retain_rev)),
+        ('leave_member_revenue', serialize_decimal(leave_rev)),
+        ('granularity', granularity),
+        ('time', OrderedDict([
+            ('year', year),
+            ('month', month),
+            ('date', serialize_date(c_date))
+        ])),
+        ('hub_plan', OrderedDict([('hub', hub), ('plan', plan)]))
+    ])
 
 
 def get_new_membership_plans_in_a_time_frame(hub_plan, start_date, end_date):
@@ -202,74 +425,3 @@ def get_leave_membership_plans_in_a_time_frame(hub_plan, start_date,
     return MembershipPlan.find(and_(MembershipPlan.hub_plan == hub_plan,
                                     MembershipPlan.end_date >= start_date,
                                     MembershipPlan.end_date <= end_date))
-
-
-def get_and_set_new_members_report_for_a_hub_plan(member_report, hub_plan,
-                                                  start_date, end_date):
-    """
-    Set the metrices of new users for a plan in a particular hub within a
-    given time frame
-    """
-    if not (isinstance(member_report, MemberReport) and
-            isinstance(hub_plan, HubPlan)):
-        return None
-
-    if start_date and end_date:
-        new_members_hp = get_new_membership_plans_in_a_time_frame(hub_plan,
-                                                                  start_date,
-                                                                  end_date)
-        new_members_hp_cnt = len(new_members_hp)
-        # print 'New Members %d between  %s and %s' % (new_members_hp_cnt,
-        #                                              start_date, end_date)
-        member_report.increment_nm_cnt_by(new_members_hp_cnt)
-        member_report.increment_nm_rev_by(new_members_hp_cnt * hub_plan.
-                                          plan.price)
-    return None
-
-
-def get_and_set_retain_members_report_for_a_hub_plan(member_report, hub_plan,
-                                                     start_date, end_date):
-    """
-    Set the metrices of retain users for a plan in a particular hub within a
-    given time frame
-    """
-    if not (isinstance(member_report, MemberReport) and
-            isinstance(hub_plan, HubPlan)):
-        return None
-
-    if start_date and end_date:
-        retain_members_hp = get_retain_membership_plans_in_a_time_frame(
-            hub_plan,
-            start_date,
-            end_date)
-        retain_members_hp_cnt = len(retain_members_hp)
-        # print 'Retain Members %d between %s and %s' % (retain_members_hp_cnt,
-        #                                                start_date, end_date)
-        member_report.increment_rm_cnt_by(retain_members_hp_cnt)
-        member_report.increment_rm_rev_by(retain_members_hp_cnt * hub_plan.
-                                          plan.price)
-    return None
-
-
-def get_and_set_leave_members_report_for_a_hub_plan(member_report, hub_plan,
-                                                    start_date, end_date):
-    """
-    Set the metrices of leave users for a plan in a particular hub within a
-    given time frame
-    """
-    if not (isinstance(member_report, MemberReport) and
-            isinstance(hub_plan, HubPlan)):
-        return None
-
-    if start_date and end_date:
-        leave_members_hp = get_leave_membership_plans_in_a_time_frame(
-            hub_plan,
-            start_date,
-            end_date)
-        leave_members_hp_cnt = len(leave_members_hp)
-        # print 'Leave Members %d between %s and %s' % (leave_members_hp_cnt,
-        #                                               start_date, end_date)
-        member_report.increment_lm_cnt_by(leave_members_hp_cnt)
-        member_report.increment_lm_rev_by(leave_members_hp_cnt * hub_plan.
-                                          plan.price)
-    return None
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+A run scoped identity map of model instances used while processing data of
+a hub, so that repeated `create_or_get` lookups are resolved in memory
+"""
+from decimal import Decimal
+from sqlalchemy.orm import joinedload
+from app.models import User, Plan, HubPlan, Membership, MembershipPlan
+from logger import logger
+
+
+def get_lookup_value(value):
+    """
+    Return a value in a form suitable to be a part of lookup key, so that
+    numbers given by cobot api match with numbers stored in database
+    """
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return Decimal(str(value))
+    return value
+
+
+class LookupCache(object):
+    """
+    Resolves `create_or_get` of model instances from memory, instances are
+    looked up by the same keyword arguments which are passed to
+    `create_or_get`. Instances created since last `commit()` are forgotten
+    on `rollback()`, so that instances rolled back from database are never
+    returned
+    """
+
+    def __init__(self):
+        self.instances = dict()
+        self.pending_keys = list()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(model, **kwargs):
+        """
+        Return a lookup key of model instance
+        """
+        return (model.__name__,) + tuple(sorted(
+            (key, get_lookup_value(value)) for key, value in kwargs.items()))
+
+    def add(self, instance, **kwargs):
+        """
+        Add a model instance to be looked up by given keyword arguments
+        """
+        self.instances[self.get_key(instance.__class__, **kwargs)] = instance
+        return instance
+
+    def create_or_get(self, model, **kwargs):
+        """
+        Return an instance from memory if already seen otherwise create if
+        instance not exists or get it from database
+        """
+        key = self.get_key(model, **kwargs)
+        instance = self.instances.get(key, None)
+
+        if instance is not None:
+            self.hits += 1
+            return instance
+
+        self.misses += 1
+        instance = model.create_or_get(**kwargs)
+        self.instances[key] = instance
+        self.pending_keys.append(key)
+        return instance
+
+    def commit(self):
+        """
+        Keep all instances looked up since last commit
+        """
+        self.pending_keys = list()
+
+    def rollback(self):
+        """
+        Forget all instances looked up since last commit
+        """
+        for key in self.pending_keys:
+            self.instances.pop(key, None)
+        self.pending_keys = list()
+
+    def preload_hub(self, hub):
+        """
+        Load all memberships, their users and last membership plans, all plans
+        and all hub plans of a hub in bulk
+        """
+        for plan in Plan.get_all():
+            self.add(plan, name=plan.name, price=plan.price)
+
+        for hub_plan in HubPlan.find(HubPlan.hub == hub):
+            self.add(hub_plan, hub=hub, plan=hub_plan.plan)
+
+        memberships = Membership.query.options(
+            joinedload(Membership.user)).filter(Membership.hub == hub).all()
+
+        for membership in memberships:
+            self.add(membership, cobot_id=membership.cobot_id,
+                     confirmed_at=membership.confirmed_at)
+
+            if membership.user:
+                user = membership.user
+                self.add(user, name=user.name, email=user.email,
+                         cobot_id=user.cobot_id)
+
+        # get last membership plan of each membership, plans are ordered in
+        # same order as `Membership.plans` relationship
+        last_membership_plans = dict()
+        membership_plans = MembershipPlan.query.join(
+            Membership, MembershipPlan.membership_id == Membership.id).filter(
+            Membership.hub == hub).order_by(MembershipPlan.start_date)
+
+        for membership_plan in membership_plans:
+            last_membership_plans[membership_plan.membership_id] = \
+                membership_plan
+
+        for membership in memberships:
+            if membership.id in last_membership_plans:
+                membership.last_membership_plan = \
+                    last_membership_plans[membership.id]
+
+        self.commit()
+
+        logger.info("Preloaded {0} memberships and {1} instances in total of "
+                    "hub {2}".format(len(memberships), len(self.instances),
+                                     hub.name))
+        return self
+
+    def log_stats(self, name=''):
+        """
+        Log hit and miss stats of lookups, each hit saves two queries of
+        `create_or_get`
+        """
+        total = self.hits + self.misses
+        logger.info("Lookups {0}: {1} hits, {2} misses ({3:.1f}% hit rate), "
+                    "{4} queries saved".format(
+                        name, self.hits, self.misses,
+                        100.0 * self.hits / total if total else 0.0,
+                        2 * self.hits))
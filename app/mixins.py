@@ -6,11 +6,92 @@ functionality to model class
 import traceback
 from app import db
 from collections import OrderedDict
+from contextlib import contextmanager
 from decimal import Decimal
 from datetime import datetime, date
+from sqlalchemy import Date, DateTime, Numeric
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
 
+def serialize_date(value):
+    """
+    Serialize a value of a date or datetime column
+    """
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def serialize_decimal(value):
+    """
+    Serialize a value of a numeric column
+    """
+    if isinstance(value, Decimal):
+        return value.to_eng_string()
+    return value
+
+
+def get_column_serializer(column):
+    """
+    Return a function to serialize values of a column depending upon it's
+    type, None if values are serialized as they are
+    """
+    if isinstance(column.type, (Date, DateTime)):
+        return serialize_date
+    elif isinstance(column.type, Numeric):
+        return serialize_decimal
+    return None
+
+
+class ModelSerializer(object):
+    """
+    Serializes instances of a model same as `ModelMixin._serialize`, but
+    columns and relationships to serialize along with serializers of their
+    values are compiled once from `__fields__` of model, instead of being
+    looked up from mapper of model for every instance
+    """
+
+    def __init__(self, model):
+        fields = getattr(model, '__fields__', [])
+
+        # all columns of model are serialized, if fields are not set
+        if isinstance(fields, property):
+            fields = [c.key for c in model.__table__.columns]
+
+        self.columns = [(c.key, get_column_serializer(c))
+                        for c in model.__table__.columns if c.key in fields]
+
+        # direct relationships(i.e not contains backref named attribute),
+        # with whether they contain a list of items or not
+        self.relationships = [
+            (key, value.lazy == 'dynamic')
+            for key, value in model.__mapper__.relationships.items()
+            if isinstance(value.backref, tuple) and key in fields]
+
+    def serialize(self, obj, relationships=True):
+        """
+        Serialize a model instance along with nested relationships
+        """
+        res = OrderedDict()
+        for key, serializer in self.columns:
+            value = getattr(obj, key)
+            res[key] = serializer(value) if serializer else value
+
+        if relationships:
+            for key, is_list in self.relationships:
+                value = getattr(obj, key)
+                if is_list:
+                    res[key] = [o.serialize() for o in value.all()]
+                else:
+                    res[key] = value.serialize() if value is not None \
+                        else None
+        return res
+
+
+# compiled serializers of models by their class
+_serializers = dict()
+
+
 class ModelMixin(db.Model):
     """
     Defines the general purpose functions for models
@@ -113,14 +194,14 @@ class ModelMixin(db.Model):
         if isinstance(obj.__class__, DeclarativeMeta):
             # if relationship contains single item(i.e One-to-Many or
             # One-to-One)
-            return obj.serialize(**kwargs)
+            return obj._serialize(**kwargs)
         else:
             # else relationship contains a list of items(i.e Many-to-Many or
             # Many-to-One)
             res = list()
             objects = getattr(self, key).all()
             for obj in objects:
-                res.append(obj.serialize())
+                res.append(obj._serialize())
             return res
 
     def _serialize_relationships(self, **kwargs):
@@ -133,9 +214,27 @@ class ModelMixin(db.Model):
                 res[r] = self._serialize_relationship(r)
         return res
 
+    @classmethod
+    def get_serializer(cls):
+        """
+        Return a serializer of model compiled on first use
+        """
+        serializer = _serializers.get(cls, None)
+        if serializer is None:
+            serializer = _serializers[cls] = ModelSerializer(cls)
+        return serializer
+
     def serialize(self, relationships=True, **kwargs):
         """
-        Serialize a model instance support nested relationships also
+        Serialize a model instance support nested relationships also, by a
+        compiled serializer of model
+        """
+        return self.get_serializer().serialize(self, relationships)
+
+    def _serialize(self, relationships=True, **kwargs):
+        """
+        Serialize a model instance support nested relationships also, by
+        looking up columns and relationships of model from it's mapper
         """
         res = OrderedDict()
         # serialize data of native columns of model
@@ -319,13 +418,68 @@ class ModelMixin(db.Model):
             traceback.print_exc()
         return None
 
+    @classmethod
+    def is_commit_deferred(cls):
+        """
+        Checks whether commits are deferred by a running unit of work or not
+        """
+        return cls.__db__.session().info.get('defer_commit', False)
+
+    @classmethod
+    @contextmanager
+    def unit_of_work(cls, expire=True):
+        """
+        Defer all commits of `save()` till the end of block, so that all
+        changes made within block are committed at once. On any error, all
+        changes made within block are rolled back. If `expire` is not set,
+        instances are not expired on commit, so that instances held by caller
+        are not reloaded from database on next access
+        """
+        session = cls.__db__.session()
+
+        # nested unit of work, outer one will commit all changes
+        if session.info.get('defer_commit', False):
+            yield session
+            return
+
+        expire_on_commit = session.expire_on_commit
+        session.info['defer_commit'] = True
+        session.expire_on_commit = expire
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.info['defer_commit'] = False
+            session.expire_on_commit = expire_on_commit
+
+    @classmethod
+    @contextmanager
+    def savepoint(cls):
+        """
+        Run a block within a savepoint, on any error only changes made within
+        block are rolled back and error is re-raised
+        """
+        session = cls.__db__.session()
+        session.begin_nested()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
     def save(self):
         """
-        Commits the model to the database and returns the model
+        Commits the model to the database and returns the model, commit is
+        skipped if it is deferred by a running unit of work
         :param model: the model to save
         """
         self.__class__._add(self)
-        self.__class__.commit()
+        if not self.__class__.is_commit_deferred():
+            self.__class__.commit()
         return self
 
     def clone(self, save=False, **kwargs):
@@ -352,7 +506,8 @@ class ModelMixin(db.Model):
         Delete a passed single instance from a database
         """
         cls._delete(instance)
-        cls.commit()
+        if not cls.is_commit_deferred():
+            cls.commit()
 
     @classmethod
     def delete_by_id(cls, id, **kwargs):
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
-from datetime import date
+from datetime import date, datetime, timedelta
 from app import db
 from app.mixins import ModelMixin
 
 # a types of plan
 PLAN_TYPES = ('Full Time', 'Part Time', 'Others', 'Ignore')
 
+# a granularities of member reports
+REPORT_GRANULARITIES = ('month', 'week', 'day')
+
+# a types of tasks whose runs are checkpointed
+TASK_TYPES = ('data', 'report', 'report-week', 'report-day')
+
+# a states of a checkpointed unit of task
+CHECKPOINT_STATES = ('running', 'completed', 'failed')
+
 
 class User(ModelMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -42,6 +51,9 @@ class Hub(ModelMixin):
     location = db.relationship('Location',
                                backref=db.backref('hub_set', lazy='dynamic'))
 
+    # date of crawl of last successfully processed data of hub
+    last_crawled_on = db.Column(db.Date)
+
     __fields__ = ['name', 'location']
 
     def __init__(self, *args, **kwargs):
@@ -50,6 +62,14 @@ class Hub(ModelMixin):
     def __repr__(self):
         return '<Hub %s %s>' % (self.name, self.location)
 
+    def set_last_crawled_on(self, c_date):
+        """
+        Set a date of crawl of last successfully processed data of hub
+        """
+        if c_date is None or isinstance(c_date, date):
+            self.last_crawled_on = c_date
+            self.save()
+
 
 class Plan(ModelMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -187,15 +207,46 @@ class Time(ModelMixin):
     __fields__ = ['year', 'month', 'date']
 
     def __init__(self, *args, **kwargs):
+        # set year and month of date before time is saved, so that it is
+        # saved only once
+        c_date = kwargs.get('date', None)
+        if isinstance(c_date, date):
+            kwargs.setdefault('year', c_date.year)
+            kwargs.setdefault('month', c_date.month)
         super(Time, self).__init__(*args, **kwargs)
-        if self.date:
-            self.year = self.date.year
-            self.month = self.date.month
-        self.save()
 
     def __repr__(self):
         return '<Time %s>' % self.date
 
+    @classmethod
+    def get_ids_of_dates(cls, dates):
+        """
+        Return a dictionary of ids of times by their dates, times of dates
+        which do not exist are created in bulk
+        """
+        dates = set(dates)
+
+        if not dates:
+            return dict()
+
+        ids = dict(db.session.query(cls.date, cls.id).filter(
+            cls.date.in_(dates)))
+
+        missing_dates = [d for d in dates if d not in ids]
+        if missing_dates:
+            db.session.bulk_insert_mappings(cls, [
+                {'date': d, 'year': d.year, 'month': d.month}
+                for d in missing_dates])
+
+            ids.update(db.session.query(cls.date, cls.id).filter(
+                cls.date.in_(missing_dates)))
+
+            # commit all changes, if commit is not deferred by a running unit
+            # of work
+            if not cls.is_commit_deferred():
+                cls.commit()
+        return ids
+
 
 class MemberReport(ModelMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -217,7 +268,17 @@ class MemberReport(ModelMixin):
     leave_member_revenue = db.Column(db.Numeric(precision=20, scale=4),
                                      default=0)
 
-    __fields__ = ['hub_plan', 'time', 'new_member_count',
+    # a period of member report, which starts at date of it's time
+    granularity = db.Column(db.Enum(*REPORT_GRANULARITIES,
+                                    name='report_granularities'),
+                            default='month', server_default='month',
+                            index=True)
+
+    # index of pagination of member reports by their time and hub plan
+    __table_args__ = (db.Index('ix_member_report_time_id_hub_plan_id',
+                               'time_id', 'hub_plan_id'),)
+
+    __fields__ = ['hub_plan', 'time', 'granularity', 'new_member_count',
                   'retain_member_count', 'leave_member_count',
                   'new_member_revenue', 'retain_member_revenue',
                   'leave_member_revenue']
@@ -228,28 +289,239 @@ class MemberReport(ModelMixin):
     def __repr__(self):
         return '<MemberReport %s %s>' % (self.hub_plan, self.time)
 
-    def reset_all_counter(self):
-        self.new_member_count = 0
-        self.retain_member_count = 0
-        self.leave_member_count = 0
-        self.new_member_revenue = 0
-        self.retain_member_revenue = 0
-        self.leave_member_revenue = 0
 
-    def increment_nm_cnt_by(self, cnt):
-        self.new_member_count += cnt
+class TaskCheckpoint(ModelMixin):
+    """
+    A checkpoint of a unit of task i.e a hub and a day for data task, and a
+    hub and a month for report task of each granularity
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.Enum(*TASK_TYPES, name='task_types'))
+    hub_id = db.Column(db.Integer, db.ForeignKey('hub.id'))
+    hub = db.relationship('Hub',
+                          backref=db.backref('task_checkpoint_set',
+                                             lazy='dynamic'))
+    date = db.Column(db.Date)
+    status = db.Column(db.Enum(*CHECKPOINT_STATES, name='checkpoint_states'))
+    duration = db.Column(db.Float, default=0)
+    row_count = db.Column(db.Integer, default=0)
+    failed_row_count = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.UniqueConstraint('task', 'hub_id', 'date'),)
+
+    __fields__ = ['task', 'hub', 'date', 'status', 'duration', 'row_count',
+                  'failed_row_count', 'updated_at']
+
+    def __init__(self, *args, **kwargs):
+        super(TaskCheckpoint, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<TaskCheckpoint %s %s %s %s>' % (self.task, self.hub,
+                                                 self.date, self.status)
+
+    @classmethod
+    def start(cls, task, hub, c_date):
+        """
+        Mark a unit of task as running and return it's checkpoint
+        """
+        checkpoint = cls.create_or_get(task=task, hub=hub, date=c_date)
+        checkpoint.update(status='running', updated_at=cls.get_now())
+        return checkpoint
+
+    def finish(self, duration, row_count=0, failed_row_count=0, failed=False):
+        """
+        Mark a unit of task as completed, or failed if whole unit or any of
+        it's row failed
+        """
+        status = 'failed' if failed or failed_row_count else 'completed'
+        self.update(status=status, duration=duration, row_count=row_count,
+                    failed_row_count=failed_row_count,
+                    updated_at=self.get_now())
+
+    @staticmethod
+    def get_now():
+        """
+        Return current time in whole seconds, same as dirty cells are marked
+        at, so that a checkpoint and a dirty cell of same second compare
+        equal whether they are stored by MySQL or not
+        """
+        return datetime.now().replace(microsecond=0)
+
+    @classmethod
+    def get_completed_units(cls, task, s_date, e_date):
+        """
+        Return a set of (hub_id, date) of all completed units of a task
+        within a given time frame
+        """
+        checkpoints = cls.find(cls.task == task,
+                               cls.status == 'completed',
+                               cls.date >= s_date,
+                               cls.date <= e_date)
+        return set((c.hub_id, c.date) for c in checkpoints)
+
+    @staticmethod
+    def get_report_task(granularity='month'):
+        """
+        Return a task of member reports of a granularity, i.e `report` for
+        monthly member reports and `report-week` or `report-day` for others
+        """
+        if granularity == 'month':
+            return 'report'
+        return 'report-' + granularity
+
+    @classmethod
+    def get_closed_report_units(cls, s_date, e_date, granularity='month'):
+        """
+        Return a set of (hub_id, date) of all closed months of report task of
+        a granularity within a given time frame, i.e months which are
+        completed and whose membership data is not changed since then. A month
+        is changed by a dirty cell of any hub plan of it's hub marked at or
+        before the month. A cell marked in same second a month is completed
+        may be marked after it, so the month is not closed
+        """
+        checkpoints = cls.find(cls.task == cls.get_report_task(granularity),
+                               cls.status == 'completed',
+                               cls.date >= s_date,
+                               cls.date <= e_date)
+
+        # dates and times of dirty cells of each hub
+        dirty_cells = dict()
+        query = db.session.query(HubPlan.hub_id, DirtyReportCell.date,
+                                 DirtyReportCell.marked_at).join(
+            DirtyReportCell, DirtyReportCell.hub_plan_id == HubPlan.id).filter(
+            DirtyReportCell.date <= e_date)
+
+        for hub_id, c_date, marked_at in query:
+            dirty_cells.setdefault(hub_id, list()).append((c_date, marked_at))
+
+        closed_units = set()
+        for c in checkpoints:
+            if not any(c_date <= c.date and marked_at >= c.updated_at
+                       for c_date, marked_at in dirty_cells.get(c.hub_id, [])):
+                closed_units.add((c.hub_id, c.date))
+        return closed_units
+
+
+class DirtyReportCell(ModelMixin):
+    """
+    A month of a hub plan whose member report is outdated by membership plans
+    created or ended while processing data, a change in a month also outdates
+    member reports of all later months of a hub plan
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    hub_plan_id = db.Column(db.Integer, db.ForeignKey('hub_plan.id'))
+    hub_plan = db.relationship('HubPlan',
+                               backref=db.backref('dirty_report_cell_set',
+                                                  lazy='dynamic'))
+    date = db.Column(db.Date, index=True)
+    marked_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.UniqueConstraint('hub_plan_id', 'date'),)
+
+    __fields__ = ['hub_plan', 'date', 'marked_at']
+
+    def __init__(self, *args, **kwargs):
+        super(DirtyReportCell, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<DirtyReportCell %s %s>' % (self.hub_plan, self.date)
+
+    @classmethod
+    def mark(cls, hub_plan, c_date):
+        """
+        Mark member report of a hub plan as dirty from month of a given date
+        """
+        if not isinstance(c_date, date):
+            return None
+
+        cell = cls.create_or_get(hub_plan=hub_plan,
+                                 date=c_date.replace(day=1))
+
+        # DATETIME of MySQL stores whole seconds, so a cell marked again is
+        # marked at least a second later than before, and a cell marked
+        # again in same second it's read is never cleared
+        marked_at = datetime.now().replace(microsecond=0)
+        if cell.marked_at is not None and marked_at <= cell.marked_at:
+            marked_at = cell.marked_at + timedelta(seconds=1)
+
+        cell.update(marked_at=marked_at)
+        return cell
+
+    @classmethod
+    def find_of_hub(cls, hub):
+        """
+        Return a list of all dirty cells of hub plans of a hub
+        """
+        return cls.query.join(HubPlan, cls.hub_plan_id == HubPlan.id).filter(
+            HubPlan.hub_id == hub.id).all()
 
-    def increment_rm_cnt_by(self, cnt):
-        self.retain_member_count += cnt
+    @classmethod
+    def clear(cls, cells):
+        """
+        Remove given dirty cells, a cell marked again since it was read is
+        kept as it is
+        """
+        for cell in cells:
+            cls.query.filter(cls.id == cell.id,
+                             cls.marked_at <= cell.marked_at).delete(
+                synchronize_session=False)
+
+
+class HubDailyStat(ModelMixin):
+    """
+    Counts of memberships of a hub on a day i.e active memberships confirmed
+    on or before it and not canceled before it, new memberships confirmed on
+    it and leaving memberships canceled on it
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    hub_id = db.Column(db.Integer, db.ForeignKey('hub.id'))
+    hub = db.relationship('Hub',
+                          backref=db.backref('daily_stat_set',
+                                             lazy='dynamic'))
+    date = db.Column(db.Date, index=True)
+    active_count = db.Column(db.Integer, default=0)
+    new_count = db.Column(db.Integer, default=0)
+    leave_count = db.Column(db.Integer, default=0)
 
-    def increment_lm_cnt_by(self, cnt):
-        self.leave_member_count += cnt
+    __table_args__ = (db.UniqueConstraint('hub_id', 'date'),)
 
-    def increment_nm_rev_by(self, cnt):
-        self.new_member_revenue += cnt
+    __fields__ = ['hub', 'date', 'active_count', 'new_count', 'leave_count']
 
-    def increment_rm_rev_by(self, cnt):
-        self.retain_member_revenue += cnt
+    def __init__(self, *args, **kwargs):
+        super(HubDailyStat, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<HubDailyStat %s %s>' % (self.hub, self.date)
 
-    def increment_lm_rev_by(self, cnt):
-        self.leave_member_revenue += cnt
+
+class CohortRetention(ModelMixin):
+    """
+    Count of memberships of a hub which are confirmed in a cohort month and
+    type of their first plan, and count of them still active at end of
+    `period` months after cohort month
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    hub_id = db.Column(db.Integer, db.ForeignKey('hub.id'))
+    hub = db.relationship('Hub',
+                          backref=db.backref('cohort_retention_set',
+                                             lazy='dynamic'))
+    plan_type = db.Column(db.Enum(*PLAN_TYPES, name='plan_types'))
+    cohort_date = db.Column(db.Date, index=True)
+    period = db.Column(db.Integer)
+    member_count = db.Column(db.Integer, default=0)
+    active_count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (db.UniqueConstraint('hub_id', 'plan_type',
+                                          'cohort_date', 'period'),)
+
+    __fields__ = ['hub', 'plan_type', 'cohort_date', 'period',
+                  'member_count', 'active_count']
+
+    def __init__(self, *args, **kwargs):
+        super(CohortRetention, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return '<CohortRetention %s %s %s %s>' % (self.hub, self.plan_type,
+                                                  self.cohort_date,
+                                                  self.period)
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+Set based computation of member report metrics, metrics of all hub plans are
+computed together instead of querying each hub plan one by one
+
+ * an aggregate query computes metrics of a single month
+ * an in memory interval engine computes metrics of many months at once
+"""
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+from decimal import Decimal
+from sqlalchemy import and_, or_, case, func
+from app import db
+from app.models import Plan, Time, HubPlan, MembershipPlan, MemberReport
+from app.utils import (get_date_obj_from_str,
+                       get_first_date_of_month,
+                       get_last_date_of_month,
+                       iter_months)
+from app.helpers import (get_new_membership_plans_in_a_time_frame,
+                         get_retain_membership_plans_in_a_time_frame,
+                         get_leave_membership_plans_in_a_time_frame)
+
+# names of count and revenue columns of member report metrics
+METRIC_NAMES = ('new_member', 'retain_member', 'leave_member')
+
+# all count and revenue columns of member report metrics
+METRIC_COLUMNS = tuple(name + suffix for name in METRIC_NAMES
+                       for suffix in ('_count', '_revenue'))
+
+# scale of revenue columns of member report, to compare stored values
+METRIC_SCALE = Decimal('0.0001')
+
+
+# ids of times by their dates, which are committed in database
+_time_ids = dict()
+
+
+def get_time_ids(dates):
+    """
+    Return a dictionary of ids of times by their dates, ids are looked up
+    from memory first and times which do not exist are created in bulk
+    """
+    dates = set(dates)
+    ids = dict((d, _time_ids[d]) for d in dates if d in _time_ids)
+
+    missing_dates = dates.difference(ids)
+    if missing_dates:
+        missing_ids = Time.get_ids_of_dates(missing_dates)
+        ids.update(missing_ids)
+
+        # times created within a running unit of work are remembered only
+        # once they are committed, as they are gone if it's rolled back
+        if not Time.is_commit_deferred():
+            _time_ids.update(missing_ids)
+    return ids
+
+
+def get_time_ids_of_periods(periods):
+    """
+    Return a dictionary of ids of times of start dates of given periods, it
+    is called before writing member reports of many periods, so that all
+    times are created in bulk at once
+    """
+    return get_time_ids(start_date for start_date, end_date in periods)
+
+
+def get_sum_of_condition(condition):
+    """
+    Return an aggregate expression which counts rows matching a condition
+    """
+    return func.sum(case([(condition, 1)], else_=0))
+
+
+def get_member_report_metrics(hub_plan_id, price, new_cnt, retain_cnt,
+                              leave_cnt):
+    """
+    Return a dictionary of member report metrics of a hub plan
+    """
+    price = Decimal(price or 0)
+    res = {'hub_plan_id': hub_plan_id}
+
+    for name, cnt in zip(METRIC_NAMES, (new_cnt, retain_cnt, leave_cnt)):
+        res[name + '_count'] = int(cnt or 0)
+        res[name + '_revenue'] = int(cnt or 0) * price
+    return res
+
+
+def get_member_report_metrics_of_a_month(date_str, hub=None):
+    """
+    Return member report metrics of all hub plans(of a hub, if passed) for a
+    given month computed by a single aggregate query
+    date_str should be in 'YYYY-MM' format.
+    """
+    # get start and end date of month
+    start_date = get_first_date_of_month(date_str)
+    end_date = get_last_date_of_month(date_str)
+
+    # conditions of a membership plan to be new, retain or leave in a month
+    # same as of `get_*_membership_plans_in_a_time_frame` helpers
+    is_new = and_(MembershipPlan.start_date >= start_date,
+                  MembershipPlan.start_date <= end_date)
+    is_retain = and_(MembershipPlan.start_date < start_date,
+                     or_(MembershipPlan.end_date == None,
+                         MembershipPlan.end_date > end_date))
+    is_leave = and_(MembershipPlan.end_date >= start_date,
+                    MembershipPlan.end_date <= end_date)
+
+    query = db.session.query(HubPlan.id,
+                             Plan.price,
+                             get_sum_of_condition(is_new),
+                             get_sum_of_condition(is_retain),
+                             get_sum_of_condition(is_leave)).join(
+        Plan, HubPlan.plan_id == Plan.id).outerjoin(
+        MembershipPlan, MembershipPlan.hub_plan_id == HubPlan.id).group_by(
+        HubPlan.id, Plan.price)
+
+    if hub is not None:
+        query = query.filter(HubPlan.hub_id == hub.id)
+
+    return [get_member_report_metrics(*row) for row in query]
+
+
+class MembershipPlanIntervals(object):
+    """
+    (start_date, end_date) intervals of all membership plans loaded at once
+    and sorted by hub plan, so that metrics of any number of periods are
+    counted by binary search instead of querying database for each period
+    """
+
+    def __init__(self, hub=None, hub_plan_ids=None):
+        self.hub_plans = dict()
+
+        # get all hub plans along with their hub and price of plan
+        query = db.session.query(HubPlan.id, HubPlan.hub_id, Plan.price).join(
+            Plan, HubPlan.plan_id == Plan.id)
+
+        if hub is not None:
+            query = query.filter(HubPlan.hub_id == hub.id)
+
+        # load only given hub plans, if passed
+        if hub_plan_ids is not None:
+            query = query.filter(HubPlan.id.in_(hub_plan_ids))
+
+        for hub_plan_id, hub_id, price in query:
+            self.hub_plans[hub_plan_id] = {
+                'hub_id': hub_id,
+                'price': price,
+                'intervals': list()
+            }
+
+        # get intervals of all membership plans
+        query = db.session.query(MembershipPlan.hub_plan_id,
+                                 MembershipPlan.start_date,
+                                 MembershipPlan.end_date)
+
+        if hub is not None:
+            query = query.join(
+                HubPlan, MembershipPlan.hub_plan_id == HubPlan.id).filter(
+                HubPlan.hub_id == hub.id)
+
+        if hub_plan_ids is not None:
+            query = query.filter(MembershipPlan.hub_plan_id.in_(hub_plan_ids))
+
+        for hub_plan_id, start_date, end_date in query:
+            if hub_plan_id in self.hub_plans:
+                self.hub_plans[hub_plan_id]['intervals'].append(
+                    (start_date, end_date))
+
+        for hub_plan in self.hub_plans.values():
+            intervals = hub_plan['intervals']
+
+            # intervals having a start date, ordered by it
+            hub_plan['intervals'] = sorted((i for i in intervals
+                                            if i[0] is not None),
+                                           key=lambda i: i[0])
+            hub_plan['start_dates'] = [i[0] for i in hub_plan['intervals']]
+            hub_plan['end_dates'] = sorted(i[1] for i in intervals
+                                           if i[1] is not None)
+
+    @staticmethod
+    def count_between(values, start_date, end_date):
+        """
+        Return count of sorted values within a given time frame(inclusive)
+        """
+        return bisect_right(values, end_date) - bisect_left(values, start_date)
+
+    def get_counts_of_hub_plan(self, hub_plan, periods):
+        """
+        Return a list of counts of new, retain and leave membership plans of a
+        hub plan of each period, periods should be ordered by their start date
+        """
+        start_dates = hub_plan['start_dates']
+        intervals = hub_plan['intervals']
+
+        # end dates of intervals started before start date of current period,
+        # which grows as periods are swept in order
+        end_dates_of_started = list()
+        cnt_of_started = 0
+
+        res = list()
+        for start_date, end_date in periods:
+            while cnt_of_started < len(intervals) and \
+                    intervals[cnt_of_started][0] < start_date:
+                if intervals[cnt_of_started][1] is not None:
+                    insort(end_dates_of_started, intervals[cnt_of_started][1])
+                cnt_of_started += 1
+
+            # retained plans are started before period and not ended till end
+            # of period
+            retain_cnt = cnt_of_started - bisect_right(end_dates_of_started,
+                                                       end_date)
+
+            res.append((self.count_between(start_dates, start_date, end_date),
+                        retain_cnt,
+                        self.count_between(hub_plan['end_dates'], start_date,
+                                           end_date)))
+        return res
+
+    def get_member_report_metrics_of_periods(self, periods, hub=None):
+        """
+        Return a list of member report metrics of all hub plans(of a hub, if
+        passed) of each period in same order as periods, periods are a list of
+        (start_date, end_date) of type datetime.date
+        """
+        order = sorted(range(len(periods)), key=lambda i: periods[i])
+        sorted_periods = [periods[i] for i in order]
+
+        res = [list() for period in periods]
+
+        for hub_plan_id in sorted(self.hub_plans):
+            hub_plan = self.hub_plans[hub_plan_id]
+
+            if hub is not None and hub_plan['hub_id'] != hub.id:
+                continue
+
+            counts = self.get_counts_of_hub_plan(hub_plan, sorted_periods)
+
+            for index, cnts in zip(order, counts):
+                res[index].append(get_member_report_metrics(
+                    hub_plan_id, hub_plan['price'], *cnts))
+        return res
+
+
+def get_dates_of_member_reports(granularity='month'):
+    """
+    Return a tuple of start dates of the earliest and the latest period of a
+    granularity for which any member report exists, if any
+    """
+    return db.session.query(func.min(Time.date), func.max(Time.date)).join(
+        MemberReport, MemberReport.time_id == Time.id).filter(
+        MemberReport.granularity == granularity).one()
+
+
+def get_period_of_month(date_str):
+    """
+    Return a tuple of first and last date of a month
+    date_str should be in 'YYYY-MM' format.
+    """
+    return (get_date_obj_from_str(get_first_date_of_month(date_str)),
+            get_date_obj_from_str(get_last_date_of_month(date_str)))
+
+
+def get_periods_of_duration(s_date, e_date, granularity='month'):
+    """
+    Return a list of (start_date, end_date) of all periods of a granularity
+    within given months, weeks start on monday so first week may start in
+    previous month
+    s_date and e_date should be in 'YYYY-MM' format.
+    """
+    if granularity == 'month':
+        return [get_period_of_month(month)
+                for month in iter_months(s_date, e_date)]
+
+    start_date = get_period_of_month(s_date)[0]
+    end_date = get_period_of_month(e_date)[1]
+
+    days = 1
+    if granularity == 'week':
+        start_date -= timedelta(days=start_date.weekday())
+        days = 7
+
+    periods = list()
+    while start_date <= end_date:
+        periods.append((start_date, start_date + timedelta(days=days - 1)))
+        start_date += timedelta(days=days)
+    return periods
+
+
+def get_legacy_member_report_metrics_of_a_month(date_str, hub=None):
+    """
+    Return member report metrics of all hub plans(of a hub, if passed) for a
+    given month computed by querying each hub plan, as member report task did
+    originally
+    date_str should be in 'YYYY-MM' format.
+    """
+    start_date = get_first_date_of_month(date_str)
+    end_date = get_last_date_of_month(date_str)
+
+    hub_plans = HubPlan.find(hub=hub) if hub is not None else \
+        HubPlan.get_all()
+
+    res = list()
+    for hub_plan in sorted(hub_plans, key=lambda hp: hp.id):
+        res.append(get_member_report_metrics(
+            hub_plan.id, hub_plan.plan.price,
+            len(get_new_membership_plans_in_a_time_frame(
+                hub_plan, start_date, end_date)),
+            len(get_retain_membership_plans_in_a_time_frame(
+                hub_plan, start_date, end_date)),
+            len(get_leave_membership_plans_in_a_time_frame(
+                hub_plan, start_date, end_date))))
+    return res
+
+
+def verify_member_report_metrics(months, hub=None):
+    """
+    Compare member report metrics of given months computed by interval engine
+    with metrics computed by querying each hub plan, return a list of
+    (month, metrics of engine, metrics of queries) of all mismatches
+    """
+    intervals = MembershipPlanIntervals(hub)
+    metrics_of_months = intervals.get_member_report_metrics_of_periods(
+        [get_period_of_month(month) for month in months], hub)
+
+    mismatches = list()
+    for month, metrics in zip(months, metrics_of_months):
+        expected_metrics = dict(
+            (m['hub_plan_id'], m) for m in
+            get_legacy_member_report_metrics_of_a_month(month, hub))
+
+        for m in metrics:
+            expected = expected_metrics.pop(m['hub_plan_id'], None)
+            if m != expected:
+                mismatches.append((month, m, expected))
+
+        for expected in expected_metrics.values():
+            mismatches.append((month, None, expected))
+    return mismatches
+
+
+def get_metric_values(values):
+    """
+    Return a tuple of metric values in a form suitable to compare values
+    computed with values stored in database
+    """
+    return tuple(Decimal(value or 0).quantize(METRIC_SCALE)
+                 for value in values)
+
+
+def save_member_reports_of_period(start_date, metrics, granularity='month',
+                                  stats=None):
+    """
+    Write member reports of all given metrics of a period of a granularity
+    which starts at a given date in bulk, missing member reports are inserted
+    and existing ones are updated only if any of their metrics differ. Counts
+    of inserted, updated and unchanged member reports are added to `stats`,
+    if passed
+    """
+    if not metrics:
+        return 0
+
+    # check time exists or not if not create time else get it's id
+    time_id = get_time_ids([start_date])[start_date]
+
+    # get ids and stored metrics of all existing member reports by their hub
+    # plan
+    hub_plan_ids = [m['hub_plan_id'] for m in metrics]
+    query = db.session.query(
+        MemberReport.hub_plan_id, MemberReport.id,
+        *[getattr(MemberReport, name) for name in METRIC_COLUMNS]).filter(
+        MemberReport.time_id == time_id,
+        MemberReport.granularity == granularity,
+        MemberReport.hub_plan_id.in_(hub_plan_ids))
+
+    reports = dict((row[0], (row[1], get_metric_values(row[2:])))
+                   for row in query)
+
+    updates = list()
+    inserts = list()
+
+    for m in metrics:
+        mapping = dict(m, time_id=time_id, granularity=granularity)
+
+        if m['hub_plan_id'] in reports:
+            report_id, values = reports[m['hub_plan_id']]
+
+            # write member report, only if it's metrics are changed
+            if values != get_metric_values(m[name] for name in
+                                           METRIC_COLUMNS):
+                mapping['id'] = report_id
+                updates.append(mapping)
+        else:
+            inserts.append(mapping)
+
+    db.session.bulk_update_mappings(MemberReport, updates)
+    db.session.bulk_insert_mappings(MemberReport, inserts)
+
+    # commit all changes, if commit is not deferred by a running unit of work
+    if not MemberReport.is_commit_deferred():
+        MemberReport.commit()
+
+    if stats is not None:
+        for key, cnt in (('inserted', len(inserts)),
+                         ('updated', len(updates)),
+                         ('unchanged',
+                          len(metrics) - len(inserts) - len(updates))):
+            stats[key] = stats.get(key, 0) + cnt
+
+    return len(metrics)
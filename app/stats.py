@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Daily counts of active, new and leaving memberships of each hub, as of each
+day, materialized in `HubDailyStat`
+
+ * stats of a single day are counted by a query, at end of a complete crawl
+   of a day
+ * stats of many days are counted from sorted dates of memberships at once,
+   to backfill them from history and to refresh all days of a hub whose
+   memberships are changed later
+ * stats of days are read from `HubDailyStat` for trends of hubs
+ * stats of cards are counted along with monthly recurring revenue by a
+   single aggregate query
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from sqlalchemy import and_, or_, case, func
+from app import db
+from app.models import Plan, HubPlan, Membership, MembershipPlan, \
+    HubDailyStat
+from app.reports import get_sum_of_condition
+from app.utils import get_current_date_obj
+
+
+def get_daily_stats(hub_id, c_date, active_cnt, new_cnt, leave_cnt):
+    """
+    Return a dictionary of daily stats of a hub
+    """
+    return {
+        'hub_id': hub_id,
+        'date': c_date,
+        'active_count': int(active_cnt or 0),
+        'new_count': int(new_cnt or 0),
+        'leave_count': int(leave_cnt or 0)
+    }
+
+
+def get_daily_stats_of_hub(hub, c_date):
+    """
+    Return daily stats of a hub on a given date counted by a single aggregate
+    query, c_date should be of type datetime.date
+    """
+    is_active = and_(Membership.confirmed_at <= c_date,
+                     or_(Membership.canceled_to == None,
+                         Membership.canceled_to >= c_date))
+
+    query = db.session.query(get_sum_of_condition(is_active),
+                             get_sum_of_condition(
+                                 Membership.confirmed_at == c_date),
+                             get_sum_of_condition(
+                                 Membership.canceled_to == c_date)).filter(
+        Membership.hub_id == hub.id)
+
+    return get_daily_stats(hub.id, c_date, *query.one())
+
+
+def iter_daily_stats_of_hub(hub, s_date, e_date):
+    """
+    Yield daily stats of a hub of all days within a given time frame one by
+    one, memberships of a hub are loaded once and counted by binary search
+    over their sorted dates
+    """
+    confirmed_dates = list()
+    canceled_dates = list()
+    inactive_dates = list()
+
+    query = db.session.query(Membership.confirmed_at,
+                             Membership.canceled_to).filter(
+        Membership.hub_id == hub.id)
+
+    for confirmed_at, canceled_to in query:
+        if canceled_to is not None:
+            canceled_dates.append(canceled_to)
+
+        if confirmed_at is None:
+            continue
+
+        confirmed_dates.append(confirmed_at)
+
+        # first day a confirmed membership is not active anymore, it is
+        # never active if it's canceled before it's confirmed
+        if canceled_to is not None:
+            inactive_dates.append(max(canceled_to + timedelta(days=1),
+                                      confirmed_at))
+
+    confirmed_dates.sort()
+    canceled_dates.sort()
+    inactive_dates.sort()
+
+    c_date = s_date
+    while c_date <= e_date:
+        # a membership is active on a day, if it's confirmed on or before it
+        # and not canceled before it
+        yield get_daily_stats(
+            hub.id, c_date,
+            bisect_right(confirmed_dates, c_date) -
+            bisect_right(inactive_dates, c_date),
+            bisect_right(confirmed_dates, c_date) -
+            bisect_right(confirmed_dates, c_date - timedelta(days=1)),
+            bisect_right(canceled_dates, c_date) -
+            bisect_right(canceled_dates, c_date - timedelta(days=1)))
+
+        c_date += timedelta(days=1)
+
+
+def save_hub_daily_stats(stats):
+    """
+    Write all given daily stats in bulk, existing stats are updated and
+    missing ones are inserted
+    """
+    if not stats:
+        return 0
+
+    # get ids of all existing stats by their hub and date
+    stat_ids = dict()
+    for hub_id in set(s['hub_id'] for s in stats):
+        dates = [s['date'] for s in stats if s['hub_id'] == hub_id]
+
+        query = db.session.query(HubDailyStat.date, HubDailyStat.id).filter(
+            HubDailyStat.hub_id == hub_id,
+            HubDailyStat.date >= min(dates),
+            HubDailyStat.date <= max(dates))
+
+        for c_date, stat_id in query:
+            stat_ids[(hub_id, c_date)] = stat_id
+
+    updates = list()
+    inserts = list()
+
+    for s in stats:
+        if (s['hub_id'], s['date']) in stat_ids:
+            updates.append(dict(s, id=stat_ids[(s['hub_id'], s['date'])]))
+        else:
+            inserts.append(s)
+
+    db.session.bulk_update_mappings(HubDailyStat, updates)
+    db.session.bulk_insert_mappings(HubDailyStat, inserts)
+
+    # commit all changes, if commit is not deferred by a running unit of work
+    if not HubDailyStat.is_commit_deferred():
+        HubDailyStat.commit()
+
+    return len(stats)
+
+
+def refresh_daily_stats_of_hub(hub):
+    """
+    Recount daily stats of all days of a hub for which they exist, from
+    current memberships of hub. A membership created or canceled later
+    changes counts of active memberships of many earlier days, so all of them
+    are refreshed at once
+    """
+    s_date, e_date = db.session.query(func.min(HubDailyStat.date),
+                                      func.max(HubDailyStat.date)).filter(
+        HubDailyStat.hub_id == hub.id).one()
+
+    if s_date is None:
+        return 0
+
+    return save_hub_daily_stats(list(iter_daily_stats_of_hub(hub, s_date,
+                                                             e_date)))
+
+
+def get_daily_stats_of_duration(hub=None, s_date=None, e_date=None):
+    """
+    Return a list of daily stats of all days within a given time frame read
+    from `HubDailyStat`, of a hub if passed otherwise summed over all hubs.
+    Days whose stats are not saved are not returned
+    """
+    query = db.session.query(HubDailyStat.date,
+                             func.sum(HubDailyStat.active_count),
+                             func.sum(HubDailyStat.new_count),
+                             func.sum(HubDailyStat.leave_count)).group_by(
+        HubDailyStat.date).order_by(HubDailyStat.date)
+
+    if hub is not None:
+        query = query.filter(HubDailyStat.hub_id == hub.id)
+
+    if s_date is not None:
+        query = query.filter(HubDailyStat.date >= s_date)
+
+    if e_date is not None:
+        query = query.filter(HubDailyStat.date <= e_date)
+
+    return [OrderedDict([('date', c_date.isoformat()),
+                         ('active_count', int(active_cnt or 0)),
+                         ('new_count', int(new_cnt or 0)),
+                         ('leave_count', int(leave_cnt or 0))])
+            for c_date, active_cnt, new_cnt, leave_cnt in query]
+
+
+def is_membership_active(c_date):
+    """
+    Return a condition of a membership to be active on a given date i.e it's
+    not canceled before it
+    """
+    return or_(Membership.canceled_to == None,
+               Membership.canceled_to >= c_date)
+
+
+def is_membership_plan_active(c_date):
+    """
+    Return a condition of a membership plan to be active on a given date
+    """
+    return and_(MembershipPlan.start_date <= c_date,
+                or_(MembershipPlan.end_date == None,
+                    MembershipPlan.end_date >= c_date))
+
+
+def get_sum_of_price_of_active_plans(c_date):
+    """
+    Return an aggregate expression which sums price of plans of membership
+    plans active on a given date, i.e monthly recurring revenue
+    """
+    return func.sum(case([(is_membership_plan_active(c_date), Plan.price)],
+                         else_=0))
+
+
+def get_card_stats(hub=None, c_date=None):
+    """
+    Return a dictionary of all counts and revenues shown on cards, of a hub
+    if passed otherwise of all hubs, as of a given date(or current date).
+    New and leaving memberships are counted since a week or a month ago,
+    including ones confirmed or canceled later than given date.
+    Counts of memberships and revenues of membership plans are aggregated by
+    two subqueries which are selected together, so that all of them are
+    fetched in a single round trip
+    """
+    c_date = c_date or get_current_date_obj()
+    week_date = c_date - timedelta(days=7)
+    month_date = c_date - timedelta(days=30)
+
+    members = db.session.query(
+        get_sum_of_condition(is_membership_active(c_date)).label(
+            'active_count'),
+        get_sum_of_condition(is_membership_active(week_date)).label(
+            'week_active_count'),
+        get_sum_of_condition(Membership.confirmed_at >= month_date).label(
+            'month_new_count'),
+        get_sum_of_condition(Membership.confirmed_at >= week_date).label(
+            'week_new_count'),
+        get_sum_of_condition(Membership.canceled_to >= week_date).label(
+            'week_leave_count')).select_from(Membership)
+
+    revenues = db.session.query(
+        get_sum_of_price_of_active_plans(c_date).label('mrr'),
+        get_sum_of_price_of_active_plans(month_date).label(
+            'month_mrr')).select_from(MembershipPlan).join(
+        HubPlan, MembershipPlan.hub_plan_id == HubPlan.id).join(
+        Plan, HubPlan.plan_id == Plan.id)
+
+    if hub is not None:
+        members = members.filter(Membership.hub_id == hub.id)
+        revenues = revenues.filter(HubPlan.hub_id == hub.id)
+
+    row = db.session.query(members.subquery(), revenues.subquery()).one()
+
+    res = dict((name, int(value or 0)) for name, value in
+               zip(row.keys(), row) if name.endswith('_count'))
+    res['mrr'] = Decimal(row.mrr or 0)
+    res['month_mrr'] = Decimal(row.month_mrr or 0)
+    return res
@@ -4,202 +4,540 @@ Two Tasks for cobot data
  * get data and insert data into database
  * calculate member report metrics
 """
-import requests
+import os
+import re
+import time
 import traceback
 import config
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
+from itertools import islice
+from app import db
+from app.client import cobot_client
+from app.lookups import LookupCache
+from app.mixins import ModelMixin
 from app.models import (
     Hub,
     Plan,
-    Time,
     User,
     HubPlan,
     Membership,
     MembershipPlan,
-    MemberReport
+    TaskCheckpoint,
+    DirtyReportCell,
+    REPORT_GRANULARITIES
 )
 from app.utils import (
     get_date_obj_from_str,
     increment_date,
+    iter_months,
     get_first_date_of_month,
-    get_last_date_of_month,
     get_current_date_str,
     is_date_format_valid,
-    dump_data_to_file,
-    get_data_from_file_if_exists
+    is_dump_file_exists,
+    open_dump_file_to_write,
+    iter_chunks_and_write,
+    iter_json_array,
+    iter_data_from_file_if_exists,
+    CHUNK_SIZE
+)
+from app.dumps import get_dump_store
+from app.cohorts import refresh_cohort_retention_of_hub
+from app.stats import (get_daily_stats_of_hub,
+                       iter_daily_stats_of_hub,
+                       refresh_daily_stats_of_hub,
+                       save_hub_daily_stats)
+from app.reports import (
+    MembershipPlanIntervals,
+    get_periods_of_duration,
+    get_dates_of_member_reports,
+    get_time_ids_of_periods,
+    save_member_reports_of_period,
+    get_member_report_metrics_of_a_month
 )
 from app.helpers import (
     preprocess_membership_data,
+    get_membership_signatures,
+    iter_changed_memberships,
     is_membership_plan_changed,
-    set_end_date_of_last_membership_plan,
-    get_and_set_new_members_report_for_a_hub_plan,
-    get_and_set_retain_members_report_for_a_hub_plan,
-    get_and_set_leave_members_report_for_a_hub_plan
+    set_end_date_of_last_membership_plan
 )
 from logger import logger
 
+# matches a file name of dumped data of a hub of a day
+# i.e <hub_name>/membership-<date_str>.json
+DUMP_FILE_NAME_RE = re.compile(
+    r'^(?P<hub_name>[^/]+)/memberships-(?P<date_str>\d{4}-\d{2}-\d{2})\.json$')
+
+
+def process_membership_data(hub, membership_data, date_of_crawl,
+                            lookups=None):
+    """
+    Process a single membership data given by cobot api, instances are looked
+    up from `lookups` cache first if it is passed
+    """
+    if lookups is None:
+        lookups = LookupCache()
+
+    # preprocess a membership data in a model suitable
+    # form
+    m_data = preprocess_membership_data(membership_data)
+
+    # check user exists or not if not create user else get it's
+    # instance
+    user = lookups.create_or_get(User, **m_data["user"])
+
+    # check membership exists or not if not create membership else
+    # get it's instance
+    membership = lookups.create_or_get(Membership, **m_data['membership'])
+
+    # assign a hub to this membership if not else do nothing
+    membership.assign_hub(hub)
+
+    # assign a user to this membership if not else do nothing
+    membership.assign_user(user)
+
+    # check plan exists or not if not create plan else get it's
+    # instance
+    plan = lookups.create_or_get(Plan, **m_data['plan'])
+
+    # check hub_plan exists or not if not create hub_plan else get
+    # it's instance
+    context = {
+        'hub': hub,
+        'plan': plan
+    }
+    hub_plan = lookups.create_or_get(HubPlan, **context)
+
+    # remember end date of last membership plan as it was before processing,
+    # so that member reports outdated by changing it can be marked dirty
+    last_membership_plan = membership.get_last_membership_plan()
+    last_end_date = last_membership_plan.end_date if last_membership_plan \
+        else None
+
+    # check if plan of a membership changed or not
+    if is_membership_plan_changed(membership, hub_plan):
+        # if plan changed then set end_date of last active plan of
+        # a membership as date_of_crawl, if any
+        last_membership_plan = set_end_date_of_last_membership_plan(
+                        membership, date_of_crawl)
+
+        # create a new membership plan instance
+        context = {
+            'membership': membership,
+            'hub_plan': hub_plan,
+            'start_date': get_date_obj_from_str(date_of_crawl)
+        }
+
+        # and, also set `start_date` of membership plan depending upon
+        # last_membership_plan existence
+        if not last_membership_plan:
+            context['start_date'] = \
+                m_data['membership']['confirmed_at']
+
+        # create a new membership plan, and also remember it as last
+        # membership plan of a membership
+        membership_plan = MembershipPlan.create(**context)
+        membership.last_membership_plan = membership_plan
+
+        # a new membership plan outdates member reports of it's hub plan from
+        # month of it's start date
+        DirtyReportCell.mark(hub_plan, membership_plan.start_date)
+    else:
+        # nothing to do
+        pass
+
+    # check if membership ended or not and, if yes set canceled_to date
+    # of membership and also set end_date of last membership_plan of
+    # this membership_plan
+    if membership_data.get('canceled_to'):
+        m_canceled_date = get_date_obj_from_str(
+            membership_data['canceled_to'])
+        membership.set_canceled_date(m_canceled_date)
+
+    # an end date set or changed on last membership plan outdates member
+    # reports of it's hub plan from month of the earlier of both end dates
+    if last_membership_plan and last_membership_plan.end_date != last_end_date:
+        DirtyReportCell.mark(last_membership_plan.hub_plan,
+                             min(d for d in (last_membership_plan.end_date,
+                                             last_end_date) if d))
+
+
+def get_last_signatures_of_hub(hub, date_of_crawl):
+    """
+    Return signatures of memberships of last processed data of a hub, only if
+    data of a given date of crawl can be diffed against it
+    """
+    last_crawled_on = hub.last_crawled_on
+
+    # data of an earlier date can not be diffed against a later one
+    if last_crawled_on is None or \
+            last_crawled_on > get_date_obj_from_str(date_of_crawl):
+        return None
+
+    data = iter_data_from_file_if_exists(
+        get_dump_file_name_of_hub(hub.name, last_crawled_on.isoformat()))
+
+    if data is None:
+        return None
+
+    return get_membership_signatures(data)
 
-def process_data_of_hub(hub, data, date_of_crawl=None):
+
+def process_data_of_hub(hub, data, date_of_crawl=None, chunk_size=None,
+                        diff=None):
     """
     Process data given by cobot api
+
+    If `diff` is set, data is diffed against last processed data of hub and
+    only new or changed memberships are processed
+
+    Data can be any iterable of memberships(i.e a generator streaming them),
+    all memberships are processed in chunks of `chunk_size`, each chunk
+    within a single unit of work which is committed once. If chunk_size is
+    `0`, whole data is processed within a single unit of work. Every
+    membership is processed within it's own savepoint, so that a bad
+    membership does not roll back whole chunk. Return a tuple of counts of
+    processed and failed memberships
     """
     # check if date of crawl is set or not
     # if not then set it with current date
     if date_of_crawl is None:
         date_of_crawl = get_current_date_str()
 
-    for index, membership_data in enumerate(data):
-        try:
-            # preprocess a membership data in a model suitable
-            # form
-            m_data = preprocess_membership_data(membership_data)
-
-            # check user exists or not if not create user else get it's
-            # instance
-            user = User.create_or_get(**m_data["user"])
-
-            # check membership exists or not if not create membership else
-            # get it's instance
-            membership = Membership.create_or_get(**m_data['membership'])
-
-            # assign a hub to this membership if not else do nothing
-            membership.assign_hub(hub)
-
-            # assign a user to this membership if not else do nothing
-            membership.assign_user(user)
-
-            # check plan exists or not if not create plan else get it's
-            # instance
-            plan = Plan.create_or_get(**m_data['plan'])
-
-            # check hub_plan exists or not if not create hub_plan else get
-            # it's instance
-            context = {
-                'hub': hub,
-                'plan': plan
-            }
-            hub_plan = HubPlan.create_or_get(**context)
-
-            # check if plan of a membership changed or not
-            if is_membership_plan_changed(membership, hub_plan):
-                # if plan changed then set end_date of last active plan of
-                # a membership as date_of_crawl, if any
-                last_membership_plan = set_end_date_of_last_membership_plan(
-                                membership, date_of_crawl)
-
-                # create a new membership plan instance
-                context = {
-                    'membership': membership,
-                    'hub_plan': hub_plan,
-                    'start_date': get_date_obj_from_str(date_of_crawl)
-                }
-
-                # and, also set `start_date` of membership plan depending upon
-                # last_membership_plan existence
-                if not last_membership_plan:
-                    context['start_date'] = \
-                        m_data['membership']['confirmed_at']
-
-                # create a new membership plan
-                membership_plan = MembershipPlan.create(**context)
-            else:
-                # nothing to do
-                pass
-
-            # check if membership ended or not and, if yes set canceled_to date
-            # of membership and also set end_date of last membership_plan of
-            # this membership_plan
-            m_canceled_date = get_date_obj_from_str(
-                membership_data['canceled_to'])
-            membership.set_canceled_date(m_canceled_date)
+    # check if chunk size is set or not, if not then set it from config
+    if chunk_size is None:
+        chunk_size = config.INGEST_CHUNK_SIZE
+
+    # check if diff is set or not, if not then set it from config
+    if diff is None:
+        diff = config.INGEST_DIFF_SNAPSHOTS
+
+    start_time = time.time()
+    cnt_of_rows = cnt_of_failed_rows = 0
+
+    last_signatures = get_last_signatures_of_hub(hub, date_of_crawl) if \
+        diff else None
+    diff_stats = dict()
+
+    if last_signatures is not None:
+        data = iter_changed_memberships(data, last_signatures, diff_stats)
+
+    data = iter(data)
+
+    # preload instances of a hub, so that most of lookups of memberships are
+    # resolved from memory. A diffed data has only a few memberships which
+    # are cheaper to look up on demand
+    lookups = LookupCache()
+    if last_signatures is None:
+        lookups.preload_hub(hub)
+
+    while True:
+        cnt_of_chunk_rows = 0
+
+        # instances are not expired on commit of a chunk, as instances held by
+        # lookups cache are only changed by this unit of work
+        with ModelMixin.unit_of_work(expire=False):
+            # process memberships of next chunk, all remaining memberships
+            # if chunk size is `0`
+            for membership_data in (islice(data, chunk_size) if chunk_size
+                                    else data):
+                cnt_of_chunk_rows += 1
+                try:
+                    with ModelMixin.savepoint():
+                        process_membership_data(hub, membership_data,
+                                                date_of_crawl, lookups)
+                    lookups.commit()
+                except Exception as e:
+                    lookups.rollback()
+                    cnt_of_failed_rows += 1
+                    logger.error(e, exc_info=True)
+
+        if not cnt_of_chunk_rows:
+            break
+
+        cnt_of_rows += cnt_of_chunk_rows
+
+    duration = time.time() - start_time
+
+    logger.info("Total {0} Memberships processed on {1} of hub {2} "
+                "({3} failed) in {4:.2f}s at {5:.1f} rows/sec".format(
+                    cnt_of_rows, date_of_crawl, hub.name, cnt_of_failed_rows,
+                    duration, cnt_of_rows / duration if duration else 0.0))
+
+    lookups.log_stats(hub.name)
+
+    if diff_stats:
+        logger.info("Memberships of hub {0} diffed against data of {1}: {2} "
+                    "new, {3} changed, {4} unchanged and {5} removed".format(
+                        hub.name, hub.last_crawled_on, diff_stats['new'],
+                        diff_stats['changed'], diff_stats['unchanged'],
+                        diff_stats['removed']))
+
+    # remember date of crawl of processed data, so that next data can be
+    # diffed against it. If any membership failed, whole next data should
+    # be processed to retry it
+    crawl_date = get_date_obj_from_str(date_of_crawl)
+    if cnt_of_failed_rows:
+        hub.set_last_crawled_on(None)
+    elif hub.last_crawled_on is None or hub.last_crawled_on < crawl_date:
+        hub.set_last_crawled_on(crawl_date)
+
+    # materialize daily stats of hub as of date of crawl, only if all of it's
+    # memberships are processed
+    if not cnt_of_failed_rows:
+        save_hub_daily_stats([get_daily_stats_of_hub(hub, crawl_date)])
+
+    return cnt_of_rows, cnt_of_failed_rows
+
+
+def get_dump_file_name_of_hub(hub_name, date_str):
+    """
+    Return a file name with hub_name as directory of dumped data of a day
+    i.e <hub_name>/membership-<date_str>.json
+    """
+    return "{0}/memberships-{1}.json".format(hub_name, date_str)
 
-        except Exception as e:
-            logger.error(e, exc_info=True)
 
-    logger.info("Total {0} Memberships processed on {1} of hub {2}".format(
-        len(data), date_of_crawl, hub.name))
+def parse_dump_file_name_of_hub(file_name):
+    """
+    Return a tuple of hub_name and date_str of a dumped data of a day, if
+    file name is of dumped data of a hub
+    """
+    match = DUMP_FILE_NAME_RE.match(file_name)
+    if match is None:
+        return None
+    return match.group('hub_name'), match.group('date_str')
 
 
-def get_data_from_api_of_hub(date_str, hub):
+def request_data_of_hub_name(date_str, hub_name):
     """
-    Get data of memberships plans from cobot api of a particular specified day
+    Send request to cobot api to get data of memberships plans of a
+    particular specified day of a hub, return a streamed response only if
+    call was made successfully
     """
-    # check date should be in valid format(i.e YYYY-MM-DD)
-    if not is_date_format_valid(date_str):
-        return None
+    logger.info("Requesting data from cobot of hub {0} and date {1}".format(
+        hub_name, date_str))
 
-    # check if hub instance is passed or not
-    if not isinstance(hub, Hub):
-        return None
+    # call end-point, send request and collect response
+    response = cobot_client.get_memberships(hub_name, date_str, stream=True)
 
-    token = 'Bearer %s' % config.COBOT_TOKEN
+    if response.status_code == 200:
+        logger.info('Data returned from api successfully of hub %s' % hub_name)
+        return response
 
-    # create a API end-point url to get data
-    membership_url = config.MEMBERSHIPS_URL_STR % hub.name
+    logger.error('Data could not returned from api successfully of hub '
+                 '{0} with status code {1}'.format(hub_name,
+                                                   response.status_code))
+    response.close()
+    return None
 
-    # set Authorization header field
-    headers = {
-        'Authorization': token
-    }
 
-    # set arbitrary arguments to be passed with request
-    params = {
-        'as_of': date_str
-    }
+def iter_data_from_response(response, file_name):
+    """
+    Parse data of response while it is being downloaded and yield memberships
+    one by one, raw data of response is also dumped to a file as it arrives
+    """
+    try:
+        with open_dump_file_to_write(file_name) as f:
+            chunks = iter_chunks_and_write(response.iter_content(CHUNK_SIZE),
+                                           f)
+            for membership_data in iter_json_array(chunks):
+                yield membership_data
+    finally:
+        response.close()
 
-    # create a file name with hub_name as directory
-    # <hub_name>/membership-<date_str>.json
-    file_name = "{0}/memberships-{1}.json".format(hub.name, date_str)
+
+def get_data_from_api_of_hub_name(date_str, hub_name):
+    """
+    Get data of memberships plans from cobot api of a particular specified day
+    of a hub by it's name. Return a generator which yields memberships one by
+    one, so that processing can start before download finishes
+    """
+    file_name = get_dump_file_name_of_hub(hub_name, date_str)
 
     # get data from dumped file if exists
-    data = get_data_from_file_if_exists(file_name)
+    data = iter_data_from_file_if_exists(file_name)
 
-    if data:
+    if data is not None:
         return data
 
-    logger.info("Requesting data from cobot of url {0} and date {0}".format(
-        membership_url, date_str))
+    response = request_data_of_hub_name(date_str, hub_name)
 
-    # call end-point, send request and collect response
-    response = requests.get(membership_url, headers=headers, params=params)
+    if response is None:
+        return None
 
-    # if call was made successfully, return data in JSON format
-    if response.status_code == 200:
-        logger.info('Data returned from api successfully of hub %s' % hub.name)
-        data = response.json()
+    return iter_data_from_response(response, file_name)
 
-        # also dump data to file
-        dump_data_to_file(data, file_name=file_name)
-        return data
-    else:
-        logger.info('Data could not returned from api successfully of hub '
-                    '{0} with status code {1}'.format(hub.name,
-                                                      response.status_code))
 
-    return None
+def download_data_of_hub_name(date_str, hub_name):
+    """
+    Download data of memberships plans from cobot api of a particular
+    specified day of a hub to a dump file without parsing it, and return file
+    name of dump if data is available. It does not touch database, so it is
+    safe to call it from worker threads
+    """
+    file_name = get_dump_file_name_of_hub(hub_name, date_str)
+
+    if is_dump_file_exists(file_name):
+        return file_name
+
+    response = request_data_of_hub_name(date_str, hub_name)
+
+    if response is None:
+        return None
+
+    try:
+        with open_dump_file_to_write(file_name) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+    finally:
+        response.close()
+
+    return file_name
 
 
-def get_and_process_data_of_day(date_str, hub_name):
+def get_data_from_api_of_hub(date_str, hub):
     """
-    Get data of a particular given day and also process that data
+    Get data of memberships plans from cobot api of a particular specified day
     """
     # check date should be in valid format(i.e YYYY-MM-DD)
     if not is_date_format_valid(date_str):
         return None
 
+    # check if hub instance is passed or not
+    if not isinstance(hub, Hub):
+        return None
+
+    return get_data_from_api_of_hub_name(date_str, hub.name)
+
+
+def process_data_of_hub_safely(hub, data, date_of_crawl, force=False):
+    """
+    Process data of a hub as a checkpointed unit of data task and log error,
+    if any, instead of raising it so that processing of other hubs continues.
+    If data is not available, unit is marked as failed. If `force` is set,
+    whole data is processed instead of only changed memberships. Return count
+    of processed memberships
+    """
+    checkpoint = None
+    start_time = time.time()
+
+    try:
+        checkpoint = TaskCheckpoint.start(
+            'data', hub, get_date_obj_from_str(date_of_crawl))
+
+        if data is None:
+            logger.error("No data available on {0} of hub {1}".format(
+                date_of_crawl, hub.name))
+            checkpoint.finish(0, failed=True)
+            return 0
+
+        cnt_of_rows, cnt_of_failed_rows = process_data_of_hub(
+            hub, data, date_of_crawl=date_of_crawl,
+            diff=False if force else None)
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        if checkpoint is not None:
+            checkpoint.finish(time.time() - start_time, failed=True)
+        return 0
+
+    checkpoint.finish(time.time() - start_time, cnt_of_rows,
+                      cnt_of_failed_rows)
+    return cnt_of_rows
+
+
+def get_hubs_to_process(hub_name):
+    """
+    Return an ordered dictionary of hubs by their names to process, hub
+    instances are bound to session of this thread, so only hub names should
+    be passed to worker threads
+    """
     # check if hub_name is passed or not, if not then get all hubs to
     # process, otherwise just process data only for that passed hub
     hubs = Hub.find(name=hub_name) if hub_name else Hub.get_all()
 
-    for hub in hubs:
-        # get data of a hub for a day
-        data = get_data_from_api_of_hub(date_str, hub=hub)
+    return OrderedDict((hub.name, hub) for hub in hubs)
+
+
+def get_hub_names_to_process(task, hubs, date_obj, completed_units):
+    """
+    Return names of hubs whose unit of a task on a given date is not
+    completed yet
+    """
+    hub_names = list()
+
+    for name, hub in hubs.items():
+        if (hub.id, date_obj) in completed_units:
+            logger.info("Skipping completed {0} task on {1} of hub "
+                        "{2}".format(task, date_obj, name))
+        else:
+            hub_names.append(name)
+    return hub_names
+
+
+def get_and_process_data_of_day(date_str, hub_name, workers=None,
+                                force=False):
+    """
+    Get data of a particular given day and also process that data
+
+    Data of all hubs is downloaded concurrently by a pool of `workers` threads
+    and data of each hub is processed as soon as it's download finishes. If
+    there is nothing to download concurrently, data is processed while it is
+    being downloaded. Hubs whose data of a day is already processed
+    completely are skipped, unless `force` is set
+    """
+    # check date should be in valid format(i.e YYYY-MM-DD)
+    if not is_date_format_valid(date_str):
+        return None
+
+    # check if workers is set or not, if not then set it from config
+    if workers is None:
+        workers = config.FETCH_WORKERS
+
+    hubs = get_hubs_to_process(hub_name)
+
+    crawl_date = get_date_obj_from_str(date_str)
+    completed_units = set() if force else \
+        TaskCheckpoint.get_completed_units('data', crawl_date, crawl_date)
+    hub_names = get_hub_names_to_process('data', hubs, crawl_date,
+                                         completed_units)
+
+    if workers <= 1 or len(hub_names) <= 1:
+        for name in hub_names:
+            # get data of a hub for a day
+            data = get_data_from_api_of_hub_name(date_str, name)
 
-        if data:
             # process a data of a hub
-            process_data_of_hub(hub, data, date_of_crawl=date_str)
+            process_data_of_hub_safely(hubs[name], data, date_str, force)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # download data of all hubs for a day
+        future_to_hub_name = dict(
+            (executor.submit(download_data_of_hub_name, date_str, name),
+             name) for name in hub_names)
+
+        for future in as_completed(future_to_hub_name):
+            hub = hubs[future_to_hub_name[future]]
+            data = None
 
+            try:
+                file_name = future.result()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+                file_name = None
+
+            if file_name:
+                data = iter_data_from_file_if_exists(file_name)
+
+            # process a data of a hub
+            process_data_of_hub_safely(hub, data, date_str, force)
 
-def start_data_task_of_day(date_str, hub_name):
+
+def start_data_task_of_day(date_str, hub_name, workers=None, force=False):
     """
     Start task to get data of a particular specified day from cobot api
     and insert that data into database
@@ -207,123 +545,638 @@ def start_data_task_of_day(date_str, hub_name):
     crawl_date = get_date_obj_from_str(date_str)
 
     # if crawl date is set then get data of crawl date and process it
-    return get_and_process_data_of_day(crawl_date.isoformat(), hub_name)
+    get_and_process_data_of_day(crawl_date.isoformat(), hub_name,
+                                workers=workers, force=force)
+
+    cobot_client.log_stats()
+
+
+def log_progress(name, cnt_of_done, cnt_of_total, start_time):
+    """
+    Log progress of a task with an estimated time to complete it
+    """
+    elapsed_time = time.time() - start_time
+    remaining_time = elapsed_time / cnt_of_done * (cnt_of_total - cnt_of_done) \
+        if cnt_of_done else 0.0
+
+    logger.info("{0} processed ({1}/{2}, {3:.1f}%), elapsed {4:.0f}s, "
+                "ETA {5:.0f}s".format(name, cnt_of_done, cnt_of_total,
+                                      100.0 * cnt_of_done / cnt_of_total,
+                                      elapsed_time, remaining_time))
 
 
-def start_data_task_of_duration(s_date, e_date, hub_name):
+def start_data_task_of_duration(s_date, e_date, hub_name, workers=None,
+                                depth=None, force=False):
     """
     Start task to get data of a particular specified duration from cobot api
     and insert that data into database
+
+    Data of upcoming days is downloaded in parallel by a pool of `workers`
+    threads up to `depth` days ahead, while downloaded data is processed in
+    order of date, so that changes of plans are detected in order for each
+    hub. Hubs whose data of a day is already processed completely are
+    skipped, unless `force` is set
     """
+    # check if workers and depth are set or not, if not then set them from
+    # config
+    if workers is None:
+        workers = config.FETCH_WORKERS
+
+    if depth is None:
+        depth = config.PREFETCH_DEPTH
+
     crawl_date = get_date_obj_from_str(s_date)
     end_date = get_date_obj_from_str(e_date)
 
+    hubs = get_hubs_to_process(hub_name)
+
+    completed_units = set() if force else \
+        TaskCheckpoint.get_completed_units('data', crawl_date, end_date)
+
+    # get names of hubs to process on all dates of crawl
+    hub_names_of_dates = list()
     while crawl_date <= end_date:
-        # get data of crawl date and process it
-        get_and_process_data_of_day(crawl_date.isoformat(), hub_name)
+        hub_names_of_dates.append((crawl_date.isoformat(),
+                                   get_hub_names_to_process('data', hubs,
+                                                            crawl_date,
+                                                            completed_units)))
 
         # increment crawl date by 1 day
         crawl_date = increment_date(crawl_date, days=1)
 
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # downloads of days in flight, in order of date
+        downloads = deque()
+        dates_to_download = iter(hub_names_of_dates)
+
+        def download_data_of_next_days(cnt_of_days):
+            for date_str, hub_names in islice(dates_to_download, cnt_of_days):
+                downloads.append((date_str, [
+                    (name, executor.submit(download_data_of_hub_name,
+                                           date_str, name))
+                    for name in hub_names]))
 
-def get_and_set_member_report_metrics_of_hub_plan(hub_plan, date_str):
+        download_data_of_next_days(depth + 1)
+
+        for index in range(len(hub_names_of_dates)):
+            date_str, futures = downloads.popleft()
+
+            # keep downloading upcoming days while this day is processed
+            download_data_of_next_days(1)
+
+            for name, future in futures:
+                data = None
+
+                try:
+                    file_name = future.result()
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+                    file_name = None
+
+                if file_name:
+                    data = iter_data_from_file_if_exists(file_name)
+
+                # process a data of a hub
+                process_data_of_hub_safely(hubs[name], data, date_str, force)
+
+            log_progress('Data of %s' % date_str, index + 1,
+                         len(hub_names_of_dates), start_time)
+
+    cobot_client.log_stats()
+
+
+def start_replay_task_of_dumps(s_date=None, e_date=None, hub_name=None,
+                               force=False):
     """
-    Calculate member report metrics for a given month from present data
-    in database
+    Start task to replay all dumped data of hubs within a given duration
+    through ingestion in order of date, without requesting cobot api. Return
+    a tuple of counts of replayed dumps and processed memberships, and time
+    taken in seconds
     """
-    if not(isinstance(hub_plan, HubPlan)):
-        return None
+    hubs = get_hubs_to_process(hub_name)
+    s_date = get_date_obj_from_str(s_date) if s_date else None
+    e_date = get_date_obj_from_str(e_date) if e_date else None
 
-    # get start date of month
-    start_date_of_month = get_first_date_of_month(date_str)
+    # discover all dumped data of hubs to replay
+    dumps = list()
+    unknown_hub_names = set()
 
-    # get end date of month
-    end_date_of_month = get_last_date_of_month(date_str)
+    for file_name in get_dump_store().iter_file_names():
+        parsed = parse_dump_file_name_of_hub(file_name)
+        if parsed is None:
+            continue
 
-    # check time exists or not if not create time else get it's instance
-    time = Time.create_or_get(date=start_date_of_month)
+        name, date_str = parsed
+        crawl_date = get_date_obj_from_str(date_str)
 
-    # check member_report exists or not if not create member_report else
-    # get it's instance
-    member_report = MemberReport.create_or_get(time=time, hub_plan=hub_plan)
+        if (s_date and crawl_date < s_date) or (e_date and crawl_date > e_date):
+            continue
+
+        if name not in hubs:
+            if not hub_name:
+                unknown_hub_names.add(name)
+            continue
+
+        dumps.append((crawl_date, name, file_name))
 
-    # reset all counters of member_report to be `0`, so that we can start
-    # with fresh member_report instance
-    member_report.reset_all_counter()
+    if unknown_hub_names:
+        logger.warning("Skipping dumps of unknown hubs {0}".format(
+            ', '.join(sorted(unknown_hub_names))))
 
-    # get and set count of all new membership plans of a particular hub and
-    # plan within a given time frame(i.e here is for a month)
-    get_and_set_new_members_report_for_a_hub_plan(member_report,
-                                                  hub_plan,
-                                                  start_date_of_month,
-                                                  end_date_of_month)
+    # replay in order of date, so that changes of plans are detected in order
+    dumps.sort()
 
-    # get and set count of all retain membership plans of a particular hub
-    # and plan within a given time frame(i.e here is for a month)
-    get_and_set_retain_members_report_for_a_hub_plan(member_report,
-                                                     hub_plan,
-                                                     start_date_of_month,
-                                                     end_date_of_month)
+    completed_units = set()
+    if dumps and not force:
+        completed_units = TaskCheckpoint.get_completed_units(
+            'data', dumps[0][0], dumps[-1][0])
 
-    # get and set count of all leave membership plans of a particular hub
-    # and plan within a given time frame(i.e here is for a month)
-    get_and_set_leave_members_report_for_a_hub_plan(member_report,
-                                                    hub_plan,
-                                                    start_date_of_month,
-                                                    end_date_of_month)
+    cnt_of_dumps = cnt_of_rows = 0
+    start_time = time.time()
 
+    for index, (crawl_date, name, file_name) in enumerate(dumps):
+        if (hubs[name].id, crawl_date) in completed_units:
+            logger.info("Skipping completed data task on {0} of hub "
+                        "{1}".format(crawl_date, name))
+        else:
+            data = iter_data_from_file_if_exists(file_name)
+            cnt_of_rows += process_data_of_hub_safely(
+                hubs[name], data, crawl_date.isoformat(), force)
+            cnt_of_dumps += 1
 
-def calculate_member_report_metrics_of_a_month(date_str, hub_name):
+        log_progress('Dump %s' % file_name, index + 1, len(dumps),
+                     start_time)
+
+    return cnt_of_dumps, cnt_of_rows, time.time() - start_time
+
+
+def add_member_report_stats(stats, unit_stats):
+    """
+    Add counts of inserted, updated and unchanged member reports of a unit of
+    report task to total stats
+    """
+    if stats is not None:
+        for key, cnt in unit_stats.items():
+            stats[key] = stats.get(key, 0) + cnt
+
+
+def print_member_report_stats(stats):
+    """
+    Print counts of inserted, updated and unchanged member reports
+    """
+    print "Total %s member reports changed (%s inserted, %s updated) and " \
+        "%s unchanged." % (stats.get('inserted', 0) + stats.get('updated', 0),
+                           stats.get('inserted', 0), stats.get('updated', 0),
+                           stats.get('unchanged', 0))
+
+
+def save_member_reports_of_hub_safely(hub, date_str, get_metrics,
+                                      stats=None, granularity='month'):
+    """
+    Save member reports of a hub for a given month as a checkpointed unit of
+    report task of a granularity, metrics of a hub are given by calling
+    `get_metrics` as a list of start date and metrics of each period of
+    month. Log error, if any, instead of raising it so that other hubs are
+    processed. Return count of processed member reports
+    """
+    month_date = get_date_obj_from_str(get_first_date_of_month(date_str))
+    checkpoint = None
+    start_time = time.time()
+    unit_stats = dict()
+
+    try:
+        checkpoint = TaskCheckpoint.start(
+            TaskCheckpoint.get_report_task(granularity), hub, month_date)
+
+        # all member reports of a hub are written in bulk and committed at
+        # once
+        with ModelMixin.unit_of_work():
+            cnt = sum(save_member_reports_of_period(
+                start_date, metrics, granularity, unit_stats)
+                for start_date, metrics in get_metrics())
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        if checkpoint is not None:
+            checkpoint.finish(time.time() - start_time, failed=True)
+        return 0
+
+    checkpoint.finish(time.time() - start_time, cnt)
+    add_member_report_stats(stats, unit_stats)
+    return cnt
+
+
+def calculate_member_report_metrics_of_a_month(date_str, hub_name,
+                                               force=False):
     """
     Calculate member report metrics for a given month from present data
-    in database for all hub_plan's
+    in database for all hub_plan's, metrics of all hub_plan's of a hub are
+    calculated with a single aggregate query. Each hub is a checkpointed unit
+    of report task and hubs whose month is closed are skipped, unless `force`
+    is set
     """
     if not is_date_format_valid(date_str, '%Y-%m'):
         return None
 
-    # store all hub_plan's to process
-    hub_plans = []
+    hubs = get_hubs_to_process(hub_name)
 
-    # get all hub_plan's to process
-    if hub_name:
-        h = Hub.first(name=hub_name)
-        hub_plans = HubPlan.find(hub=h)
-    else:
-        hub_plans = HubPlan.get_all()
+    month_date = get_date_obj_from_str(get_first_date_of_month(date_str))
+    closed_units = set() if force else \
+        TaskCheckpoint.get_closed_report_units(month_date, month_date)
+
+    # store count of all hub_plan's processed
+    cnt_of_hub_plans = 0
+    stats = dict()
+
+    hub_names = get_hub_names_to_process('report', hubs, month_date,
+                                         closed_units)
+    for name in hub_names:
+        hub = hubs[name]
+        cnt_of_hub_plans += save_member_reports_of_hub_safely(
+            hub, date_str,
+            lambda: [(month_date,
+                      get_member_report_metrics_of_a_month(date_str, hub))],
+            stats)
+
+    print "Total %s plans of all hub processed." % cnt_of_hub_plans
+    print_member_report_stats(stats)
+    print_report_units(len(hub_names), len(hubs) - len(hub_names))
+
+
+# id of process whose connections are set up by `init_report_worker`
+_report_worker_pid = None
+
+
+def init_report_worker():
+    """
+    Set up a forked worker process of report task once, a worker must not
+    use session inherited from it's parent process
+    """
+    global _report_worker_pid
+
+    if _report_worker_pid != os.getpid():
+        db.session.remove()
+        _report_worker_pid = os.getpid()
+
+
+def get_member_report_metrics_of_unit(date_str, hub_id):
+    """
+    Return member report metrics of a hub for a given month, it runs in a
+    worker process of report task and only reads from database, so that only
+    plain values are passed to and returned from it
+    """
+    init_report_worker()
+
+    try:
+        return get_member_report_metrics_of_a_month(date_str,
+                                                    Hub.get(id=hub_id))
+    finally:
+        # do not hold a connection while waiting for next unit
+        db.session.remove()
+
+
+def calculate_member_report_metrics_in_parallel(months, hub_name, workers,
+                                                force=False):
+    """
+    Calculate member report metrics of given months by fanning out each
+    month and hub as a unit to a pool of `workers` processes. Workers only
+    compute metrics, which are written back by this process in order of
+    months and hubs, so result is same whatever order workers finish in.
+    Closed units are skipped, unless `force` is set
+    """
+    months = [m for m in months if is_date_format_valid(m, '%Y-%m')]
+
+    if not months:
+        return None
+
+    hubs = get_hubs_to_process(hub_name)
+
+    month_dates = [get_date_obj_from_str(get_first_date_of_month(m))
+                   for m in months]
+    closed_units = set() if force else \
+        TaskCheckpoint.get_closed_report_units(month_dates[0],
+                                               month_dates[-1])
+
+    units = list()
+    for month, month_date in zip(months, month_dates):
+        for name in get_hub_names_to_process('report', hubs, month_date,
+                                             closed_units):
+            units.append((month, name, hubs[name].id))
+
+    # create times of all months at once, before any unit of work
+    get_time_ids_of_periods([(d, None) for d in month_dates])
+
+    # forked worker processes must not share connections of this process,
+    # so release connection of session and discard all pooled connections
+    # before starting workers
+    db.session.commit()
+    db.engine.dispose()
+
+    # store count of all hub_plan's processed
+    cnt_of_hub_plans = 0
+    stats = dict()
+    start_time = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(month, name, executor.submit(
+            get_member_report_metrics_of_unit, month, hub_id))
+            for month, name, hub_id in units]
+
+        for index, (month, name, future) in enumerate(futures):
+            month_date = get_date_obj_from_str(get_first_date_of_month(month))
+            cnt_of_hub_plans += save_member_reports_of_hub_safely(
+                hubs[name], month,
+                lambda: [(month_date, future.result())], stats)
+
+            log_progress('Report of %s of hub %s' % (month, name), index + 1,
+                         len(futures), start_time)
 
-    # calculate member report metrics for each plan of all hub
-    for hub_plan in hub_plans:
-        get_and_set_member_report_metrics_of_hub_plan(hub_plan, date_str)
+    print "Total %s plans of all hub processed." % cnt_of_hub_plans
+    print_member_report_stats(stats)
+    print_report_units(len(units), len(months) * len(hubs) - len(units))
 
-    print "Total %s plans of all hub processed." % len(hub_plans)
 
+def calculate_member_report_metrics_of_granularity(months, hub_name,
+                                                   granularity, force=False):
+    """
+    Calculate member report metrics of all periods of a granularity(i.e
+    months, weeks or days) of given months. Each month of a hub is a
+    checkpointed unit of report task of granularity and closed units are
+    skipped, unless `force` is set. Intervals of all membership plans are
+    loaded once, and metrics of all periods of a hub are computed in a
+    single pass over them
+    """
+    months = [m for m in months if is_date_format_valid(m, '%Y-%m')]
+
+    if not months:
+        return None
 
-def start_report_task_of_month(date_str, hub_name):
+    hubs = get_hubs_to_process(hub_name)
+
+    month_dates = [get_date_obj_from_str(get_first_date_of_month(m))
+                   for m in months]
+    closed_units = set() if force else \
+        TaskCheckpoint.get_closed_report_units(month_dates[0],
+                                               month_dates[-1], granularity)
+
+    # periods of whole duration, each of them is a period of month it ends
+    # in(or of last month), so that a week which spans two months is
+    # computed and saved once. A month marked dirty reopens all later months
+    # too, so a week is recomputed whenever any of it's days is changed
+    periods_of_months = [list() for _ in months]
+    for period in get_periods_of_duration(months[0], months[-1],
+                                          granularity):
+        index = bisect_right(month_dates, period[1]) - 1
+        periods_of_months[index].append(period)
+
+    # indexes of months to compute of each hub
+    indexes_of_hubs = OrderedDict()
+    for name, hub in hubs.items():
+        indexes = [i for i, month_date in enumerate(month_dates)
+                   if (hub.id, month_date) not in closed_units]
+
+        if indexes:
+            indexes_of_hubs[name] = indexes
+        else:
+            logger.info("Skipping closed months of {0} report task of hub "
+                        "{1}".format(granularity, name))
+
+    cnt_of_computed = sum(len(i) for i in indexes_of_hubs.values())
+
+    # intervals are not loaded at all and times are not created, if all
+    # months are closed
+    if indexes_of_hubs:
+        intervals = MembershipPlanIntervals(
+            hubs.values()[0] if hub_name and hubs else None)
+        get_time_ids_of_periods(sum(periods_of_months, []))
+
+    # store count of all member reports processed
+    cnt_of_reports = 0
+    stats = dict()
+
+    for name, indexes in indexes_of_hubs.items():
+        hub = hubs[name]
+
+        # metrics of all periods of all months to compute of a hub
+        periods = sum([periods_of_months[i] for i in indexes], [])
+        metrics_of_periods = iter(
+            intervals.get_member_report_metrics_of_periods(periods, hub))
+
+        for i in indexes:
+            metrics_of_month = [(start_date, next(metrics_of_periods))
+                                for start_date, _ in periods_of_months[i]]
+
+            cnt_of_reports += save_member_reports_of_hub_safely(
+                hub, months[i], lambda: metrics_of_month, stats,
+                granularity)
+
+        print 'Report of %ss processed of hub %s\n' % (granularity, name)
+
+    print "Total %s member reports of all hub processed." % cnt_of_reports
+    print_member_report_stats(stats)
+    print_report_units(cnt_of_computed,
+                       len(months) * len(hubs) - cnt_of_computed, granularity)
+
+
+def start_report_task_of_month(date_str, hub_name, force=False,
+                               workers=None, granularity=None):
     """
     Start task to calculate member report metrics of a particular given
-    month from data in database
+    month from data in database, hubs are processed by `workers` processes
+    if passed. Member reports of all granularities are calculated, unless a
+    `granularity` is passed
     """
     print 'Report processed on %s \n' % date_str
-    return calculate_member_report_metrics_of_a_month(date_str, hub_name)
 
+    for g in [granularity] if granularity else REPORT_GRANULARITIES:
+        if g != 'month':
+            calculate_member_report_metrics_of_granularity(
+                [date_str], hub_name, g, force=force)
+        elif workers:
+            calculate_member_report_metrics_in_parallel(
+                [date_str], hub_name, workers, force=force)
+        else:
+            calculate_member_report_metrics_of_a_month(date_str, hub_name,
+                                                       force=force)
 
-def start_report_task_of_duration(s_date, e_date, hub_name):
+    refresh_cohort_retention_of_hubs(hub_name)
+
+
+def print_report_units(cnt_of_computed, cnt_of_skipped, granularity='month'):
+    """
+    Print count of months of hubs computed and skipped by report task of a
+    granularity
+    """
+    print "Total %s months of hubs computed and %s closed months skipped " \
+        "of %s member reports." % (cnt_of_computed, cnt_of_skipped,
+                                   granularity)
+
+
+def start_report_task_of_duration(s_date, e_date, hub_name, force=False,
+                                  workers=None, granularity=None):
     """
     Start task to calculate member report metrics of a particular given
     duration from data in database
+
+    Intervals of all membership plans are loaded once, and metrics of all
+    periods of a hub are computed in a single pass over them. If `workers`
+    is passed, each month and hub of monthly member reports is computed by a
+    pool of processes instead. Member reports of all granularities are
+    calculated, unless a `granularity` is passed. Closed months of hubs are
+    skipped, unless `force` is set
+    s_date and e_date should be in 'YYYY-MM' format.
     """
-    crawl_date = get_date_obj_from_str(get_first_date_of_month(s_date))
-    end_date = get_date_obj_from_str(get_last_date_of_month(e_date))
+    if not is_date_format_valid(s_date, '%Y-%m') or \
+            not is_date_format_valid(e_date, '%Y-%m'):
+        return None
 
-    while crawl_date <= end_date:
-        # convert crawl date of format `YYYY-MM-DD` to `YYYY-MM`
-        crawl_date_str = crawl_date.isoformat().rsplit('-', 1)[0]
+    months = list(iter_months(s_date, e_date))
 
-        # get data of crawl date and process it
-        calculate_member_report_metrics_of_a_month(crawl_date_str, hub_name)
+    if not months:
+        return None
 
-        print 'Report processed on %s\n' % crawl_date_str
+    for g in [granularity] if granularity else REPORT_GRANULARITIES:
+        if g == 'month' and workers:
+            calculate_member_report_metrics_in_parallel(
+                months, hub_name, workers, force=force)
+        else:
+            calculate_member_report_metrics_of_granularity(
+                months, hub_name, g, force=force)
 
-        # increment crawl date by 1 day
-        crawl_date = increment_date(crawl_date, weeks=4)
+    refresh_cohort_retention_of_hubs(hub_name)
+
+
+def calculate_member_report_metrics_of_dirty_cells(hub, stats=None):
+    """
+    Recalculate member reports of all granularities of dirty hub plans of a
+    hub, from month they are marked dirty till latest period of member
+    reports, and clear their dirty cells. Daily stats of hub are refreshed
+    too, as memberships changed by them change stats of earlier days. Return
+    count of member reports recalculated
+    """
+    unit_stats = dict()
+
+    # all member reports of a hub are written and it's dirty cells are
+    # cleared at once
+    with ModelMixin.unit_of_work():
+        cells = DirtyReportCell.find_of_hub(hub)
+
+        if not cells:
+            return 0
+
+        # earliest dirty month of each hub plan
+        start_dates = dict()
+        for cell in cells:
+            start_dates[cell.hub_plan_id] = min(
+                cell.date, start_dates.get(cell.hub_plan_id, cell.date))
+
+        intervals = MembershipPlanIntervals(hub, start_dates.keys())
+        cnt_of_reports = 0
+
+        for granularity in REPORT_GRANULARITIES:
+            first_date, last_date = get_dates_of_member_reports(granularity)
+
+            # weekly and daily member reports are recalculated only if they
+            # are calculated ever
+            if granularity != 'month' and last_date is None:
+                continue
+
+            # later periods of a dirty month are recalculated till latest
+            # period of member reports, as retained plans of them are changed
+            # too, but periods before earliest member report are not
+            start_date = max([min(start_dates.values())] +
+                             ([first_date] if first_date else []))
+            end_date = max(start_dates.values() +
+                           ([last_date] if last_date else []))
+            periods = get_periods_of_duration(start_date.isoformat()[:7],
+                                              end_date.isoformat()[:7],
+                                              granularity)
+
+            metrics_of_periods = \
+                intervals.get_member_report_metrics_of_periods(periods, hub)
+
+            for (start_date, end_date), metrics in zip(periods,
+                                                       metrics_of_periods):
+                cnt_of_reports += save_member_reports_of_period(
+                    start_date, [m for m in metrics
+                                 if start_dates[m['hub_plan_id']] <= end_date],
+                    granularity, unit_stats)
+
+        cnt_of_stats = refresh_daily_stats_of_hub(hub)
+
+        DirtyReportCell.clear(cells)
+
+    add_member_report_stats(stats, unit_stats)
+
+    logger.info("Recalculated {0} member reports and {1} daily stats of {2} "
+                "dirty cells of hub {3}".format(cnt_of_reports, cnt_of_stats,
+                                               len(cells), hub.name))
+    return cnt_of_reports
+
+
+def start_report_task_of_dirty_cells(hub_name):
+    """
+    Start task to recalculate only member reports outdated by membership
+    plans created or ended while processing data
+    """
+    # store count of all member reports recalculated
+    cnt_of_reports = 0
+    stats = dict()
+
+    for name, hub in get_hubs_to_process(hub_name).items():
+        try:
+            cnt_of_reports += calculate_member_report_metrics_of_dirty_cells(
+                hub, stats)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    print "Total %s dirty member reports recalculated." % cnt_of_reports
+    print_member_report_stats(stats)
+
+    refresh_cohort_retention_of_hubs(hub_name)
+
+
+def refresh_cohort_retention_of_hubs(hub_name):
+    """
+    Recompute cohort retention of hubs from data in database, each hub is
+    replaced within it's own unit of work
+    """
+    for name, hub in get_hubs_to_process(hub_name).items():
+        try:
+            with ModelMixin.unit_of_work():
+                cnt = refresh_cohort_retention_of_hub(hub)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            continue
+
+        logger.info("Cohort retention of hub {0} refreshed with {1} "
+                    "rows".format(name, cnt))
+
+
+def start_stats_task_of_duration(s_date, e_date, hub_name):
+    """
+    Start task to backfill daily stats of hubs of a particular given
+    duration from data in database, e_date is current date if not passed
+    s_date and e_date should be in 'YYYY-MM-DD' format.
+    """
+    if not is_date_format_valid(s_date) or \
+            (e_date and not is_date_format_valid(e_date)):
+        return None
+
+    start_date = get_date_obj_from_str(s_date)
+    end_date = get_date_obj_from_str(e_date or get_current_date_str())
+
+    # store count of all daily stats processed
+    cnt_of_stats = 0
+
+    for name, hub in get_hubs_to_process(hub_name).items():
+        # all daily stats of a hub are written in bulk and committed at once
+        with ModelMixin.unit_of_work():
+            cnt = save_hub_daily_stats(
+                list(iter_daily_stats_of_hub(hub, start_date, end_date)))
+
+        cnt_of_stats += cnt
+        print 'Daily stats of %s days processed of hub %s' % (cnt, name)
 
+    print "Total %s daily stats of all hub processed." % cnt_of_stats
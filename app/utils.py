@@ -2,13 +2,20 @@
 """
 Basic utilities functions
 """
-import os
+import re
 import json
 import datetime
 import config
 from calendar import monthrange
+from dumps import get_dump_store
 from logger import logger
 
+# size of chunks in bytes, in which raw data is read or written
+CHUNK_SIZE = 64 * 1024
+
+# matches whitespaces and separators between items of a JSON array
+JSON_ARRAY_SEPARATOR_RE = re.compile(r'[\s,]*')
+
 
 def get_current_date_obj():
     """
@@ -67,7 +74,7 @@ def is_date_format_valid(date_str, _format='%Y-%m-%d'):
     try:
         get_datetime_obj_from_str(date_str, _format=_format)
         return True
-    except ValueError:
+    except (ValueError, TypeError):
         return False
 
 
@@ -94,6 +101,21 @@ def get_last_date_of_month(date_str):
     return '%s-%d' % (date_str, monthrange(year, month)[1])
 
 
+def iter_months(s_date, e_date):
+    """
+    Yield all months of a given duration one by one in 'YYYY-MM' format
+    s_date and e_date should be in 'YYYY-MM' format.
+    """
+    year, month = map(int, s_date.split('-')[:2])
+    e_year, e_month = map(int, e_date.split('-')[:2])
+
+    while (year, month) <= (e_year, e_month):
+        yield '%04d-%02d' % (year, month)
+
+        # move to first month of next year after last month of a year
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
 def increment_date(date, **kwargs):
     """
     Increment date by no. of specified days
@@ -110,32 +132,137 @@ def decrement_date(date, **kwargs):
     return increment_date(date, **kwargs)
 
 
-def dump_data_to_file(data, file_name=None):
-    basedir = config.DUMP_FOLDER_PATH or os.getcwd()
-    f_path, f_name = file_name.rsplit("/", 1)
-    abs_file_path = os.path.join(basedir, "dump", f_path)
+def is_dump_file_exists(file_name):
+    """
+    Checks whether a dump file exists or not in dump store
+    """
+    return get_dump_store().exists(file_name)
+
+
+def open_dump_file_to_write(file_name):
+    """
+    Open a dump file to write raw data in dump store, dump is stored only if
+    whole block completes successfully, so that a partially written dump file
+    is never left behind
+    """
+    return get_dump_store().open_to_write(file_name)
 
-    if not os.path.isdir(abs_file_path):
-        os.makedirs(abs_file_path)
 
-    abs_file_path = os.path.join(abs_file_path, f_name)
+def iter_file_chunks(f, chunk_size=CHUNK_SIZE):
+    """
+    Read a file in chunks and yield them one by one
+    """
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
 
-    with open(abs_file_path, 'w+') as f:
-        json.dump(data, f)
-    logger.info("Data dumped to {0}".format(abs_file_path))
 
+def iter_chunks_and_write(chunks, f):
+    """
+    Yield chunks one by one and also write each of them to a file
+    """
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
 
-def get_data_from_file_if_exists(file_name):
-    basedir = config.DUMP_FOLDER_PATH or os.getcwd()
-    f_path, f_name = file_name.rsplit("/", 1)
-    abs_file_path = os.path.join(basedir, "dump", f_path)
-    abs_file_path = os.path.join(abs_file_path, f_name)
 
-    if not os.path.exists(abs_file_path):
-        logger.info("No dumped file found at {0}".format(abs_file_path))
+def is_json_value_complete(buf, pos):
+    """
+    Checks whether raw data of a JSON value starting at a position is
+    complete within buffer or not, by matching it's brackets outside of
+    strings. A value which is not an object or array is complete once it's
+    followed by a separator
+    """
+    depth = 0
+    is_in_string = False
+    is_escaped = False
+
+    for c in buf[pos:]:
+        if is_in_string:
+            if is_escaped:
+                is_escaped = False
+            elif c == '\\':
+                is_escaped = True
+            elif c == '"':
+                is_in_string = False
+        elif c == '"':
+            is_in_string = True
+        elif c in '[{':
+            depth += 1
+        elif c in ']}':
+            depth -= 1
+            if depth <= 0:
+                return True
+        elif c == ',' and depth == 0:
+            return True
+    return False
+
+
+def iter_json_array(chunks):
+    """
+    Parse a JSON array incrementally from chunks of it's raw data and yield
+    it's items one by one, so that whole array is never loaded in memory
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    is_started = False
+
+    for chunk in chunks:
+        buf = buf[pos:] + chunk
+        pos = 0
+
+        while True:
+            # skip whitespaces and separators before next item
+            pos = JSON_ARRAY_SEPARATOR_RE.match(buf, pos).end()
+
+            if pos == len(buf):
+                break
+
+            if not is_started:
+                if buf[pos] != '[':
+                    raise ValueError("Data is not a JSON array")
+                is_started = True
+                pos += 1
+                continue
+
+            if buf[pos] == ']':
+                return
+
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError, e:
+                # raw data of item is complete, so it's not valid JSON
+                if is_json_value_complete(buf, pos):
+                    raise ValueError("Data is not a valid JSON array: "
+                                     "%s" % e)
+
+                # item is not complete yet, wait for next chunk
+                break
+
+            yield item
+
+    raise ValueError("Data is not a complete JSON array")
+
+
+def iter_data_from_file_if_exists(file_name):
+    """
+    Return a generator which yields items of data dumped in a file one by
+    one, if file exists
+    """
+    dump_store = get_dump_store()
+
+    if not dump_store.exists(file_name):
+        logger.info("No dumped file found of {0}".format(file_name))
         return None
 
-    with open(abs_file_path, "r") as f:
-        data = json.load(f)
-    logger.info("Dumped file found at {0}".format(abs_file_path))
-    return data
+    logger.info("Dumped file found of {0}".format(file_name))
+
+    def iter_data():
+        with dump_store.open_to_read(file_name) as f:
+            for item in iter_json_array(iter_file_chunks(f)):
+                yield item
+
+    return iter_data()
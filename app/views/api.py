@@ -1,21 +1,39 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
 from flask.ext.api import status
-from app.models import PLAN_TYPES, Hub
+from app.models import PLAN_TYPES, REPORT_GRANULARITIES, Hub
 from collections import OrderedDict
 from app import app, cache
-from app.utils import is_date_format_valid
-from app.helpers import (get_cnt_of_active_members_in_past,
-                         get_cnt_of_new_members_in_past,
-                         get_cnt_of_leave_members_in_past,
+from app.utils import (get_date_obj_from_str,
+                       decrement_date,
+                       get_current_date_obj,
+                       is_date_format_valid)
+from app.helpers import (REPORT_GROUP_BY_COLUMNS,
                          get_all_hub_plans_of_plan_type,
-                         get_all_member_reports_of_hub_plans)
+                         get_member_report_rows_of_hub_plans,
+                         iter_member_report_rows_of_hub_plans,
+                         get_grouped_member_reports_of_hub_plans,
+                         get_cursor_of_member_report_row,
+                         parse_cursor_of_member_reports,
+                         serialize_member_report_row)
+from app.cohorts import get_cohort_retention
+from app.stats import get_card_stats, get_daily_stats_of_duration
+import json
 import urllib
 
 # create blueprint instance
 api = Blueprint('API', __name__, url_prefix='/api')
 
+# mimetypes of formats of streamed member reports
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+# number of rows fetched from database by a query of a page, while streaming
+STREAM_BATCH_SIZE = 1000
+
 
 def make_cache_key():
     """
@@ -31,6 +49,44 @@ def make_cache_key():
     return cache_key
 
 
+def is_streamed_request():
+    """
+    Checks whether response of a request is streamed or not, streamed
+    responses are never cached
+    """
+    return bool(request.args.get('stream', None))
+
+
+def get_url_of_next_page(after):
+    """
+    Return url of next page of a paginated request, which starts after a
+    given cursor
+    """
+    args = request.args
+    return request.base_url + '?' + urllib.urlencode([
+        (k, v) for k in sorted(args) if k != 'after'
+        for v in sorted(args.getlist(k))
+    ] + [('after', after)])
+
+
+def iter_streamed_member_reports(rows, stream_format):
+    """
+    Yield serialized member reports as chunks of a json array or as lines of
+    ndjson, one by one as rows are fetched from database
+    """
+    if stream_format == 'ndjson':
+        for row in rows:
+            yield json.dumps(serialize_member_report_row(row)) + '\n'
+    else:
+        separator = '['
+        for row in rows:
+            yield separator + json.dumps(serialize_member_report_row(row))
+            separator = ','
+
+        # an empty array, if there are no rows
+        yield ']' if separator == ',' else '[]'
+
+
 @api.route("/cards", methods=['GET'])
 @cache.cached(key_prefix=make_cache_key)
 def get_cards():
@@ -50,11 +106,13 @@ def get_cards():
     # intializise list to have results to return as response
     res = list()
 
+    # get data of all cards at once
+    stats = get_card_stats(hub)
+
     # get data and create output of card 1
-    present_active_members = get_cnt_of_active_members_in_past(hub, days=0)
-    new_members_in_past_months = get_cnt_of_new_members_in_past(hub, days=30)
+    present_active_members = stats['active_count']
+    new_members_in_past_months = stats['month_new_count']
 
-    print present_active_members, new_members_in_past_months
     card_1 = OrderedDict()
     card_1["card_no"] = 1
     card_1['total_active_members'] = present_active_members
@@ -66,14 +124,23 @@ def get_cards():
     res.append(card_1)
 
     # get data and create output of card 2
+    mrr_value = stats['mrr']
+    mrr_value_of_past_month = stats['month_mrr']
+
     card_2 = OrderedDict()
     card_2["card_no"] = 2
+    card_2['mrr_value'] = float(mrr_value)
+    card_2['increment_revenue'] = {
+        'percent': round(float(mrr_value - mrr_value_of_past_month) /
+                         float(mrr_value_of_past_month)*100, 1)
+        if mrr_value_of_past_month else 0.0,
+        'duration': 30
+    }
     res.append(card_2)
 
     # get data and create output of card 3
-    active_members_till_past_week = get_cnt_of_active_members_in_past(hub,
-                                                                      days=7)
-    new_members_in_past_weeks = get_cnt_of_new_members_in_past(hub, days=7)
+    active_members_till_past_week = stats['week_active_count']
+    new_members_in_past_weeks = stats['week_new_count']
 
     card_3 = OrderedDict()
     card_3["card_no"] = 3
@@ -86,7 +153,7 @@ def get_cards():
     res.append(card_3)
 
     # get data and create output of card 4
-    leave_members_in_past_weeks = get_cnt_of_leave_members_in_past(hub, days=7)
+    leave_members_in_past_weeks = stats['week_leave_count']
 
     card_4 = OrderedDict()
     card_4["card_no"] = 4
@@ -103,7 +170,7 @@ def get_cards():
 
 
 @api.route("/reports", methods=['GET'])
-@cache.cached(key_prefix=make_cache_key)
+@cache.cached(key_prefix=make_cache_key, unless=is_streamed_request)
 def get_reports():
     # extract hub_name` argument from request
     hub_name = request.args.get('hub_name', None)
@@ -117,6 +184,19 @@ def get_reports():
     #  extract to
     to_d = request.args.get('to', None)
 
+    #  extract granularity, by default monthly member reports
+    granularity = request.args.get('granularity', 'month')
+
+    #  extract limit and cursor of a page of member reports
+    limit = request.args.get('limit', None)
+    after = request.args.get('after', None)
+
+    #  extract format of streamed member reports
+    stream_format = request.args.get('stream', None)
+
+    #  extract dimensions to group member reports by i.e 'hub,plan_type'
+    group_by = request.args.get('group_by', None)
+
     # By default, hub=None signify all hubs
     hub = None
 
@@ -138,18 +218,140 @@ def get_reports():
             return ({'error': 'Date should be in YYYY-MM format'},
                     status.HTTP_400_BAD_REQUEST)
 
+    if granularity not in REPORT_GRANULARITIES:
+        return ({'error': 'No such granularity found'},
+                status.HTTP_400_BAD_REQUEST)
+
+    if limit is not None:
+        limit = int(limit) if limit.isdigit() else 0
+        if limit <= 0:
+            return ({'error': 'Limit should be a positive number'},
+                    status.HTTP_400_BAD_REQUEST)
+
+    if after is not None:
+        after = parse_cursor_of_member_reports(after)
+        if after is None:
+            return ({'error': 'After should be in TIME_ID-HUB_PLAN_ID '
+                              'format'},
+                    status.HTTP_400_BAD_REQUEST)
+
+    if stream_format and stream_format not in STREAM_FORMATS:
+        return ({'error': 'No such stream format found'},
+                status.HTTP_400_BAD_REQUEST)
+
+    if group_by is not None:
+        # remove duplicate dimensions, keeping order of them
+        group_by = list(OrderedDict.fromkeys(
+            name.strip() for name in group_by.split(',')))
+
+        if not all(name in REPORT_GROUP_BY_COLUMNS for name in group_by):
+            return ({'error': 'No such group by found'},
+                    status.HTTP_400_BAD_REQUEST)
+
+        if limit is not None or after is not None or stream_format:
+            return ({'error': 'Group by can not be paginated or streamed'},
+                    status.HTTP_400_BAD_REQUEST)
+
     # intializise list to have results to return as response
     res = list()
 
     # get all hub plans for all above plans
     hub_plans = get_all_hub_plans_of_plan_type(hub, plan_type)
 
-    # get member report's for all hub_plan's
-    m_reports = get_all_member_reports_of_hub_plans(hub_plans, from_d, to_d)
+    # sum member report's of all hub_plan's within each group
+    if group_by is not None:
+        return (get_grouped_member_reports_of_hub_plans(
+            hub_plans, group_by, from_d, to_d, granularity),
+            status.HTTP_200_OK)
+
+    # stream member report's as pages of them are fetched, so that memory is
+    # not grown by size of response
+    if stream_format:
+        rows = iter_member_report_rows_of_hub_plans(
+            hub_plans, from_d, to_d, granularity, after, limit,
+            STREAM_BATCH_SIZE)
+        return Response(stream_with_context(iter_streamed_member_reports(
+            rows, stream_format)), mimetype=STREAM_FORMATS[stream_format])
+
+    # get member report's for all hub_plan's as plain rows
+    rows = get_member_report_rows_of_hub_plans(hub_plans, from_d, to_d,
+                                               granularity, after, limit)
 
     # serialize all member report's and append to them in result
-    for mr in m_reports:
-        res.append(mr.serialize())
+    row = None
+    for row in rows:
+        res.append(serialize_member_report_row(row))
+
+    # link to next page, if page is full
+    headers = dict()
+    if limit is not None and len(res) == limit:
+        headers['Link'] = '<%s>; rel="next"' % get_url_of_next_page(
+            get_cursor_of_member_report_row(row))
+
+    return (res, status.HTTP_200_OK, headers)
+
+
+@api.route("/cohorts", methods=['GET'])
+@cache.cached(key_prefix=make_cache_key)
+def get_cohorts():
+    # extract hub_name` argument from request
+    hub_name = request.args.get('hub_name', None)
+
+    #  extract plan_type
+    plan_type = request.args.get('plan_type', None)
+
+    # By default, hub=None signify all hubs
+    hub = None
+
+    # if hub_name is passed in request arguments, then get hub's instance
+    if hub_name:
+        hub = Hub.first(name=hub_name)
+        if not hub:
+            return ({'error': 'No such hub found'},
+                    status.HTTP_400_BAD_REQUEST)
+
+    if plan_type:
+        if plan_type not in PLAN_TYPES:
+            return ({'error': 'No such plan type found'},
+                    status.HTTP_400_BAD_REQUEST)
+
+    # get precomputed cohort retention of all cohorts
+    res = get_cohort_retention(hub, plan_type)
+
+    return (res, status.HTTP_200_OK)
+
+
+@api.route("/daily_stats", methods=['GET'])
+@cache.cached(key_prefix=make_cache_key)
+def get_daily_stats():
+    # extract hub_name` argument from request
+    hub_name = request.args.get('hub_name', None)
+
+    #  extract from and to dates, by default last 30 days
+    from_d = request.args.get('from', None)
+    to_d = request.args.get('to', None)
+
+    # By default, hub=None signify all hubs
+    hub = None
+
+    # if hub_name is passed in request arguments, then get hub's instance
+    if hub_name:
+        hub = Hub.first(name=hub_name)
+        if not hub:
+            return ({'error': 'No such hub found'},
+                    status.HTTP_400_BAD_REQUEST)
+
+    if (from_d and not is_date_format_valid(from_d)) or \
+            (to_d and not is_date_format_valid(to_d)):
+        return ({'error': 'Date should be in YYYY-MM-DD format'},
+                status.HTTP_400_BAD_REQUEST)
+
+    e_date = get_date_obj_from_str(to_d) if to_d else get_current_date_obj()
+    s_date = get_date_obj_from_str(from_d) if from_d else \
+        decrement_date(e_date, days=-30)
+
+    # get materialized daily stats of all days
+    res = get_daily_stats_of_duration(hub, s_date, e_date)
 
     return (res, status.HTTP_200_OK)
 
@@ -10,7 +10,30 @@ SQLALCHEMY_DATABASE_URI = os.environ.get('COBOT_DB_URL',
 
 # cobot constants
 COBOT_TOKEN = os.getenv('COBOT_TOKEN', None)
-MEMBERSHIPS_URL_STR = 'http://%s.cobot.me/api/memberships'
+MEMBERSHIPS_URL_STR = os.environ.get('MEMBERSHIPS_URL_STR',
+                                     'http://%s.cobot.me/api/memberships')
+
+# cobot http client settings
+COBOT_POOL_SIZE = int(os.environ.get('COBOT_POOL_SIZE', 10))
+COBOT_CONNECT_TIMEOUT = float(os.environ.get('COBOT_CONNECT_TIMEOUT', 5))
+COBOT_READ_TIMEOUT = float(os.environ.get('COBOT_READ_TIMEOUT', 60))
+COBOT_MAX_RETRIES = int(os.environ.get('COBOT_MAX_RETRIES', 5))
+COBOT_BACKOFF_FACTOR = float(os.environ.get('COBOT_BACKOFF_FACTOR', 0.5))
+COBOT_MAX_BACKOFF = float(os.environ.get('COBOT_MAX_BACKOFF', 60))
+
+# ingestion constants
+# number of threads to request data of hubs from cobot concurrently
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 6))
+
+# number of upcoming days downloaded ahead of processing during backfill
+PREFETCH_DEPTH = int(os.environ.get('PREFETCH_DEPTH', 3))
+
+# number of memberships committed at once, `0` to commit whole hub data at once
+INGEST_CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 500))
+
+# process only memberships changed since last processed data of a hub
+INGEST_DIFF_SNAPSHOTS = os.environ.get('INGEST_DIFF_SNAPSHOTS',
+                                       'true').lower() == 'true'
 
 # Flask-Cache settings
 CACHE_DEFAULT_TIMEOUT = 86400
@@ -18,5 +41,9 @@ CACHE_DEFAULT_TIMEOUT = 86400
 # Dump data folder
 DUMP_FOLDER_PATH = os.environ.get('DUMP_FOLDER_PATH', None)
 
+# Dump store, `file` stores plain files under `DUMP_FOLDER_PATH/dump` and
+# `gzip` stores compressed and deduplicated files under `DUMP_FOLDER_PATH/store`
+DUMP_STORE = os.environ.get('DUMP_STORE', 'file')
+
 # logger config
 LOG_FILE_PATH = os.environ.get('LOG_FILE_PATH', None)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import sys
+import time
 import traceback
 from flask.ext.migrate import Migrate, MigrateCommand
 from flask.ext.script import (Shell, Server, Manager, Command,
@@ -8,10 +9,21 @@ from flask.ext.script import (Shell, Server, Manager, Command,
 from flask.ext.script.commands import InvalidCommand
 from app import app
 from app.models import *
+from app.dumps import FileDumpStore, CompressedDumpStore, migrate_dump_store
+from app.reports import verify_member_report_metrics
+from app.helpers import (get_all_hub_plans_of_plan_type,
+                         get_all_member_reports_of_hub_plans,
+                         get_member_report_rows_of_hub_plans,
+                         serialize_member_report_row)
+from app.utils import iter_months
 from app.tasks import (start_data_task_of_day,
                        start_data_task_of_duration,
+                       start_replay_task_of_dumps,
                        start_report_task_of_month,
-                       start_report_task_of_duration)
+                       start_report_task_of_duration,
+                       start_report_task_of_dirty_cells,
+                       start_stats_task_of_duration,
+                       get_hubs_to_process)
 import urllib
 
 
@@ -108,19 +120,44 @@ def fill_db():
     print 'Data filled to tables successfully.'
 
 
+@manager.option('-r', '--remove', dest='remove', action='store_true',
+                default=False, help="remove migrated plain dump files")
+def migrate_dumps(remove):
+    """Migrates plain dump files to compressed and deduplicated dump store"""
+    source = FileDumpStore()
+    target = CompressedDumpStore()
+
+    source_size = source.get_total_size()
+    cnt_of_dumps = migrate_dump_store(source, target, remove=remove)
+
+    print 'Total %d dump files migrated from %s to %s.' % (
+        cnt_of_dumps, source.basedir, target.basedir)
+    print 'Size of plain dump files: %d bytes, size of dump store: %d ' \
+        'bytes.' % (source_size, target.get_total_size())
+
+
 @manager.option('-sd', '--startDate', dest='start_date', default=None,
                 help="start date of crawl in 'YYYY-MM-DD' format")
 @manager.option('-ed', '--endDate', dest='end_date', default=None,
                 help="end date of crawl in 'YYYY-MM-DD' format")
 @manager.option('-h', '--hub', dest='hub_name', default=None,
                 help="name of hub")
-def run_task_data(start_date, end_date, hub_name):
+@manager.option('-w', '--workers', dest='workers', default=None, type=int,
+                help="no. of threads to request data of hubs concurrently")
+@manager.option('-d', '--depth', dest='depth', default=None, type=int,
+                help="no. of upcoming days to request ahead of processing")
+@manager.option('-f', '--force', dest='force', action='store_true',
+                default=False, help="process already completed days again")
+def run_task_data(start_date, end_date, hub_name, workers, depth, force):
     """Runs a task to get and insert data from cobot api"""
     try:
         if start_date and end_date:
-            start_data_task_of_duration(start_date, end_date, hub_name)
+            start_data_task_of_duration(start_date, end_date, hub_name,
+                                        workers=workers, depth=depth,
+                                        force=force)
         elif start_date:
-            start_data_task_of_day(start_date, hub_name)
+            start_data_task_of_day(start_date, hub_name, workers=workers,
+                                   force=force)
         else:
             print 'Check argument options, type command with --help'
             return
@@ -130,19 +167,61 @@ def run_task_data(start_date, end_date, hub_name):
         traceback.print_exc()
 
 
+@manager.option('-sd', '--startDate', dest='start_date', default=None,
+                help="start date of dumps in 'YYYY-MM-DD' format")
+@manager.option('-ed', '--endDate', dest='end_date', default=None,
+                help="end date of dumps in 'YYYY-MM-DD' format")
+@manager.option('-h', '--hub', dest='hub_name', default=None,
+                help="name of hub")
+@manager.option('-f', '--force', dest='force', action='store_true',
+                default=False, help="replay dumps of already completed days")
+def replay_dumps(start_date, end_date, hub_name, force):
+    """Replays dumped data of cobot api into database without network"""
+    try:
+        cnt_of_dumps, cnt_of_rows, duration = start_replay_task_of_dumps(
+            start_date, end_date, hub_name, force=force)
+
+        print 'Total %d dumps replayed with %d memberships in %.2fs.' % (
+            cnt_of_dumps, cnt_of_rows, duration)
+        if duration:
+            print 'Throughput: %.1f memberships/sec, %.2f dumps/sec.' % (
+                cnt_of_rows / duration, cnt_of_dumps / duration)
+
+        print '===> Task Completed'
+    except Exception:
+        traceback.print_exc()
+
+
 @manager.option('-sd', '--startDate', dest='start_date', default=None,
                 help="start date of crawl in 'YYYY-MM' format")
 @manager.option('-ed', '--endDate', dest='end_date', default=None,
                 help="end date of crawl in 'YYYY-MM' format")
 @manager.option('-h', '--hub', dest='hub_name', default=None,
                 help="name of hub")
-def run_task_report(start_date, end_date, hub_name):
+@manager.option('-f', '--force', dest='force', action='store_true',
+                default=False, help="process already completed months again")
+@manager.option('-dt', '--dirty', dest='dirty', action='store_true',
+                default=False, help="process only dirty member reports")
+@manager.option('-w', '--workers', dest='workers', default=None, type=int,
+                help="number of processes to calculate months and hubs")
+@manager.option('-g', '--granularity', dest='granularity', default=None,
+                choices=REPORT_GRANULARITIES,
+                help="granularity of member reports i.e month, week or day, "
+                "all of them if not passed")
+def run_task_report(start_date, end_date, hub_name, force, dirty, workers,
+                    granularity):
     """Runs a task to calculate member report metrics from database data"""
     try:
-        if start_date and end_date:
-            start_report_task_of_duration(start_date, end_date, hub_name)
+        if dirty:
+            start_report_task_of_dirty_cells(hub_name)
+        elif start_date and end_date:
+            start_report_task_of_duration(start_date, end_date, hub_name,
+                                          force=force, workers=workers,
+                                          granularity=granularity)
         elif start_date:
-            start_report_task_of_month(start_date, hub_name)
+            start_report_task_of_month(start_date, hub_name, force=force,
+                                       workers=workers,
+                                       granularity=granularity)
         else:
             print 'Check argument options, type command with --help'
             return
@@ -152,6 +231,107 @@ def run_task_report(start_date, end_date, hub_name):
         traceback.print_exc()
 
 
+@manager.option('-sd', '--startDate', dest='start_date', default=None,
+                help="start date of stats in 'YYYY-MM-DD' format")
+@manager.option('-ed', '--endDate', dest='end_date', default=None,
+                help="end date of stats in 'YYYY-MM-DD' format")
+@manager.option('-h', '--hub', dest='hub_name', default=None,
+                help="name of hub")
+def backfill_daily_stats(start_date, end_date, hub_name):
+    """Backfills daily stats of hubs from database data"""
+    try:
+        if not start_date:
+            print 'Check argument options, type command with --help'
+            return
+
+        start_stats_task_of_duration(start_date, end_date, hub_name)
+
+        print '===> Task Completed'
+    except Exception:
+        traceback.print_exc()
+
+
+@manager.option('-sd', '--startDate', dest='start_date', default=None,
+                help="start date of reports in 'YYYY-MM' format")
+@manager.option('-ed', '--endDate', dest='end_date', default=None,
+                help="end date of reports in 'YYYY-MM' format")
+@manager.option('-h', '--hub', dest='hub_name', default=None,
+                help="name of hub")
+def verify_reports(start_date, end_date, hub_name):
+    """Verifies member report metrics of interval engine against queries"""
+    try:
+        if not start_date:
+            print 'Check argument options, type command with --help'
+            return
+
+        months = list(iter_months(start_date, end_date or start_date))
+
+        cnt_of_mismatches = 0
+        for name, hub in get_hubs_to_process(hub_name).items():
+            for month, metrics, expected in verify_member_report_metrics(
+                    months, hub):
+                cnt_of_mismatches += 1
+                print 'Mismatch on %s of hub %s:\n  engine:  %s\n  ' \
+                    'queries: %s' % (month, name, metrics, expected)
+
+        print 'Total %d mismatches found in %d months.' % (cnt_of_mismatches,
+                                                           len(months))
+    except Exception:
+        traceback.print_exc()
+
+
+@manager.option('-h', '--hub', dest='hub_name', default=None,
+                help="name of hub")
+@manager.option('-g', '--granularity', dest='granularity', default='month',
+                choices=REPORT_GRANULARITIES,
+                help="granularity of member reports")
+@manager.option('-n', '--repeat', dest='repeat', default=3, type=int,
+                help="number of times each serializer is run")
+def benchmark_serializers(hub_name, granularity, repeat):
+    """Compares serializers of member reports of /api/reports"""
+    try:
+        hub = Hub.first(name=hub_name) if hub_name else None
+        hub_plans = get_all_hub_plans_of_plan_type(hub)
+
+        def get_member_reports():
+            # member reports are loaded again on each run, so that time to
+            # load them is measured too
+            db.session.expire_all()
+            return get_all_member_reports_of_hub_plans(
+                hub_plans, granularity=granularity)
+
+        # each serializer loads and serializes all member reports
+        serializers = [
+            ('reflective', lambda: [mr._serialize()
+                                    for mr in get_member_reports()]),
+            ('compiled', lambda: [mr.serialize()
+                                  for mr in get_member_reports()]),
+            ('row', lambda: [serialize_member_report_row(row) for row in
+                             get_member_report_rows_of_hub_plans(
+                                 hub_plans, granularity=granularity)])
+        ]
+
+        # all serializers must give same result
+        results = [sorted(serialize()) for name, serialize in serializers]
+        if any(res != results[0] for res in results):
+            print 'Serializers give different results.'
+            return
+
+        for name, serialize in serializers:
+            durations = list()
+            for i in range(repeat):
+                start_time = time.time()
+                serialize()
+                durations.append(time.time() - start_time)
+
+            duration = min(durations)
+            print '%-10s %d member reports in %.4fs (%.1f reports/sec).' % (
+                name, len(results[0]), duration,
+                len(results[0]) / duration if duration else 0.0)
+    except Exception:
+        traceback.print_exc()
+
+
 if __name__ == '__main__':
     try:
         manager.run()
@@ -0,0 +1,35 @@
+"""add hub daily stat
+
+Revision ID: 1e8811c8cbed
+Revises: 427a670a3b2d
+Create Date: 2026-10-18 12:28:07.708442
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1e8811c8cbed'
+down_revision = '427a670a3b2d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'hub_daily_stat',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hub_id', sa.Integer(), nullable=True),
+        sa.Column('date', sa.Date(), nullable=True),
+        sa.Column('active_count', sa.Integer(), nullable=True),
+        sa.Column('new_count', sa.Integer(), nullable=True),
+        sa.Column('leave_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['hub_id'], ['hub.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hub_id', 'date')
+    )
+    op.create_index('ix_hub_daily_stat_date', 'hub_daily_stat', ['date'])
+
+
+def downgrade():
+    op.drop_index('ix_hub_daily_stat_date', table_name='hub_daily_stat')
+    op.drop_table('hub_daily_stat')
@@ -0,0 +1,29 @@
+"""add granularity of member report
+
+Revision ID: 223ce5f89c47
+Revises: 51fa3bfbda59
+Create Date: 2026-10-18 12:19:03.469222
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '223ce5f89c47'
+down_revision = '51fa3bfbda59'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('member_report', sa.Column(
+        'granularity', sa.Enum('month', 'week', 'day',
+                               name='report_granularities'),
+        server_default='month', nullable=True))
+    op.create_index('ix_member_report_granularity', 'member_report',
+                    ['granularity'])
+
+
+def downgrade():
+    op.drop_index('ix_member_report_granularity',
+                  table_name='member_report')
+    op.drop_column('member_report', 'granularity')
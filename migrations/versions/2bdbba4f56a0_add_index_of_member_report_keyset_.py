@@ -0,0 +1,24 @@
+"""add index of member report keyset pagination
+
+Revision ID: 2bdbba4f56a0
+Revises: None
+Create Date: 2026-10-18 12:16:53.213148
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2bdbba4f56a0'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_member_report_time_id_hub_plan_id', 'member_report',
+                    ['time_id', 'hub_plan_id'])
+
+
+def downgrade():
+    op.drop_index('ix_member_report_time_id_hub_plan_id',
+                  table_name='member_report')
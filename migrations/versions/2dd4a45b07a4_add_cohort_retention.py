@@ -0,0 +1,40 @@
+"""add cohort retention
+
+Revision ID: 2dd4a45b07a4
+Revises: 1e8811c8cbed
+Create Date: 2026-10-18 12:28:16.422783
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2dd4a45b07a4'
+down_revision = '1e8811c8cbed'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'cohort_retention',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hub_id', sa.Integer(), nullable=True),
+        sa.Column('plan_type', sa.Enum('Full Time', 'Part Time', 'Others',
+                                       'Ignore', name='plan_types'),
+                  nullable=True),
+        sa.Column('cohort_date', sa.Date(), nullable=True),
+        sa.Column('period', sa.Integer(), nullable=True),
+        sa.Column('member_count', sa.Integer(), nullable=True),
+        sa.Column('active_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['hub_id'], ['hub.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hub_id', 'plan_type', 'cohort_date', 'period')
+    )
+    op.create_index('ix_cohort_retention_cohort_date', 'cohort_retention',
+                    ['cohort_date'])
+
+
+def downgrade():
+    op.drop_index('ix_cohort_retention_cohort_date',
+                  table_name='cohort_retention')
+    op.drop_table('cohort_retention')
@@ -0,0 +1,35 @@
+"""add dirty report cell
+
+Revision ID: 427a670a3b2d
+Revises: d76753292f
+Create Date: 2026-10-18 12:27:59.300229
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '427a670a3b2d'
+down_revision = 'd76753292f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'dirty_report_cell',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hub_plan_id', sa.Integer(), nullable=True),
+        sa.Column('date', sa.Date(), nullable=True),
+        sa.Column('marked_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['hub_plan_id'], ['hub_plan.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('hub_plan_id', 'date')
+    )
+    op.create_index('ix_dirty_report_cell_date', 'dirty_report_cell',
+                    ['date'])
+
+
+def downgrade():
+    op.drop_index('ix_dirty_report_cell_date',
+                  table_name='dirty_report_cell')
+    op.drop_table('dirty_report_cell')
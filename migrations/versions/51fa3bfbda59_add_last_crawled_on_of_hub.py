@@ -0,0 +1,23 @@
+"""add last crawled on of hub
+
+Revision ID: 51fa3bfbda59
+Revises: 2bdbba4f56a0
+Create Date: 2026-10-18 12:18:50.600140
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '51fa3bfbda59'
+down_revision = '2bdbba4f56a0'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('hub', sa.Column('last_crawled_on', sa.Date(),
+                                   nullable=True))
+
+
+def downgrade():
+    op.drop_column('hub', 'last_crawled_on')
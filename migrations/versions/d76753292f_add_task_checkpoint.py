@@ -0,0 +1,40 @@
+"""add task checkpoint
+
+Revision ID: d76753292f
+Revises: 223ce5f89c47
+Create Date: 2026-10-18 12:26:20.930217
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd76753292f'
+down_revision = '223ce5f89c47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'task_checkpoint',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task', sa.Enum('data', 'report', 'report-week',
+                                  'report-day', name='task_types'),
+                  nullable=True),
+        sa.Column('hub_id', sa.Integer(), nullable=True),
+        sa.Column('date', sa.Date(), nullable=True),
+        sa.Column('status', sa.Enum('running', 'completed', 'failed',
+                                    name='checkpoint_states'),
+                  nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('row_count', sa.Integer(), nullable=True),
+        sa.Column('failed_row_count', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['hub_id'], ['hub.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('task', 'hub_id', 'date')
+    )
+
+
+def downgrade():
+    op.drop_table('task_checkpoint')
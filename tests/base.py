@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+A base test case which runs application against an in memory sqlite
+database, all tables are created before and dropped after each test
+"""
+from flask.ext.testing import TestCase
+from app import app, db, cache
+
+
+class BaseTestCase(TestCase):
+    """
+    Defines the general purpose set up of all test cases
+    """
+
+    def create_app(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        return app
+
+    def setUp(self):
+        db.create_all()
+        cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import date
+from sqlalchemy import event
+from app.mixins import ModelMixin
+from app.models import (Location, Hub, Plan, Time, HubPlan, Membership,
+                        MembershipPlan, MemberReport, DirtyReportCell,
+                        TaskCheckpoint)
+from app.reports import (MembershipPlanIntervals,
+                         get_period_of_month,
+                         get_member_report_metrics_of_a_month,
+                         verify_member_report_metrics)
+from app.helpers import (get_all_hub_plans_of_plan_type,
+                         get_all_member_reports_of_hub_plans)
+from app import db, cache
+from tests.base import BaseTestCase
+
+
+def create_membership(hub, cobot_id, plans, canceled_to=None):
+    """
+    Create a membership of a hub along with it's membership plans, plans are
+    a list of (hub_plan, start_date, end_date)
+    """
+    membership = Membership(cobot_id=cobot_id, hub=hub,
+                            confirmed_at=plans[0][1],
+                            canceled_to=canceled_to)
+
+    for hub_plan, start_date, end_date in plans:
+        MembershipPlan(hub_plan=hub_plan, membership=membership,
+                       start_date=start_date, end_date=end_date)
+    return membership
+
+
+class MemberReportMetricsTestCase(BaseTestCase):
+    """
+    Member report metrics computed by interval engine must be same as
+    metrics computed by queries
+    """
+    months = ['2014-11', '2014-12', '2015-01', '2015-02', '2015-03',
+              '2015-04']
+
+    def setUp(self):
+        super(MemberReportMetricsTestCase, self).setUp()
+
+        self.hub = Hub(name='hub', location=Location(name='Delhi'))
+        self.full_time = HubPlan(hub=self.hub,
+                                 plan=Plan(name='Full Time', price=5000))
+        self.part_time = HubPlan(hub=self.hub,
+                                 plan=Plan(name='Part Time', price=2500))
+
+        # open ended plan starting within a month
+        create_membership(self.hub, '1', [
+            (self.full_time, date(2015, 1, 15), None)])
+
+        # plan ending on last day of a month, and next plan starting on
+        # first day of next month
+        create_membership(self.hub, '2', [
+            (self.full_time, date(2014, 12, 1), date(2015, 1, 31)),
+            (self.part_time, date(2015, 2, 1), None)])
+
+        # canceled membership
+        create_membership(self.hub, '3', [
+            (self.part_time, date(2014, 11, 10), date(2015, 2, 14))],
+            canceled_to=date(2015, 2, 14))
+
+        # plan ending on first day of a month
+        create_membership(self.hub, '4', [
+            (self.full_time, date(2014, 12, 15), date(2015, 3, 1))],
+            canceled_to=date(2015, 3, 1))
+
+        # plan starting and ending within same month
+        create_membership(self.hub, '5', [
+            (self.part_time, date(2015, 2, 3), date(2015, 2, 20))],
+            canceled_to=date(2015, 2, 20))
+
+    def get_metrics_of_months(self):
+        intervals = MembershipPlanIntervals(self.hub)
+        return intervals.get_member_report_metrics_of_periods(
+            [get_period_of_month(month) for month in self.months], self.hub)
+
+    def get_counts(self, metrics, hub_plan):
+        m = [m for m in metrics if m['hub_plan_id'] == hub_plan.id][0]
+        return (m['new_member_count'], m['retain_member_count'],
+                m['leave_member_count'])
+
+    def test_metrics_same_as_of_queries_of_each_hub_plan(self):
+        self.assertEqual(verify_member_report_metrics(self.months, self.hub),
+                         [])
+
+    def test_metrics_same_as_of_aggregate_query(self):
+        for month, metrics in zip(self.months, self.get_metrics_of_months()):
+            self.assertEqual(
+                sorted(metrics, key=lambda m: m['hub_plan_id']),
+                sorted(get_member_report_metrics_of_a_month(month, self.hub),
+                       key=lambda m: m['hub_plan_id']))
+
+    def test_counts_on_boundaries_of_months(self):
+        metrics = dict(zip(self.months, self.get_metrics_of_months()))
+
+        # (new, retain, leave) counts of each month
+        self.assertEqual(self.get_counts(metrics['2015-01'], self.full_time),
+                         (1, 1, 1))
+        self.assertEqual(self.get_counts(metrics['2015-02'], self.full_time),
+                         (0, 2, 0))
+        self.assertEqual(self.get_counts(metrics['2015-03'], self.full_time),
+                         (0, 1, 1))
+        self.assertEqual(self.get_counts(metrics['2015-02'], self.part_time),
+                         (2, 0, 2))
+        self.assertEqual(self.get_counts(metrics['2015-03'], self.part_time),
+                         (0, 1, 0))
+        self.assertEqual(
+            metrics['2015-02'][0]['retain_member_revenue'] +
+            metrics['2015-02'][1]['retain_member_revenue'], 10000)
+
+
+class DirtyReportCellTestCase(BaseTestCase):
+    """
+    A dirty cell marked again since it was read must not be cleared, and a
+    month marked dirty since it was completed must not be closed
+    """
+
+    def setUp(self):
+        super(DirtyReportCellTestCase, self).setUp()
+
+        hub = Hub(name='hub')
+        hub_plan = HubPlan(hub=hub, plan=Plan(name='Full Time', price=5000))
+        self.hub_id = hub.id
+        self.hub_plan_id = hub_plan.id
+
+    def find_cells(self):
+        return DirtyReportCell.find_of_hub(Hub.get(id=self.hub_id))
+
+    def mark(self, c_date):
+        DirtyReportCell.mark(HubPlan.get(id=self.hub_plan_id), c_date)
+
+    def test_cell_marked_again_in_same_second_is_kept(self):
+        self.mark(date(2015, 1, 15))
+        cells = self.find_cells()
+        marked_at = cells[0].marked_at
+
+        # cell is marked again by another session, while it's read
+        db.session.expunge_all()
+        self.mark(date(2015, 1, 20))
+
+        DirtyReportCell.clear(cells)
+        DirtyReportCell.commit()
+
+        cells = self.find_cells()
+        self.assertEqual(len(cells), 1)
+        self.assertGreater(cells[0].marked_at, marked_at)
+
+    def test_cell_not_marked_again_is_cleared(self):
+        self.mark(date(2015, 1, 15))
+
+        DirtyReportCell.clear(self.find_cells())
+        DirtyReportCell.commit()
+
+        self.assertEqual(self.find_cells(), [])
+
+    def get_closed_units(self):
+        month_date = date(2015, 1, 1)
+        return TaskCheckpoint.get_closed_report_units(month_date, month_date)
+
+    def test_month_marked_in_same_second_it_is_completed_is_not_closed(self):
+        checkpoint = TaskCheckpoint.start('report', Hub.get(id=self.hub_id),
+                                          date(2015, 1, 1))
+        checkpoint.finish(0)
+        self.assertEqual(self.get_closed_units(),
+                         set([(self.hub_id, date(2015, 1, 1))]))
+
+        # cell is marked after month is completed, within same second
+        self.mark(date(2015, 1, 15))
+        cell = self.find_cells()[0]
+        cell.update(marked_at=checkpoint.updated_at)
+
+        self.assertEqual(self.get_closed_units(), set())
+
+
+class MemberReportQueryCountTestCase(BaseTestCase):
+    """
+    Count of queries run by /api/reports must not grow with count of hub
+    plans and member reports
+    """
+    months = [date(2015, 1, 1), date(2015, 2, 1), date(2015, 3, 1)]
+
+    def create_member_reports(self, cnt_of_hubs):
+        """
+        Create hubs, each with a location and a hub plan, along with member
+        reports of hub plans of all months
+        """
+        with ModelMixin.unit_of_work():
+            times = [Time.create_or_get(date=d) for d in self.months]
+            offset = Hub.query.count()
+
+            for i in range(offset, offset + cnt_of_hubs):
+                hub_plan = HubPlan(
+                    hub=Hub(name='hub%d' % i,
+                            location=Location(name='location%d' % i)),
+                    plan=Plan(name='plan%d' % i, type='Full Time',
+                              price=1000))
+
+                for time in times:
+                    MemberReport(time=time, hub_plan=hub_plan,
+                                 new_member_count=i, retain_member_count=i,
+                                 leave_member_count=i)
+
+    def get_cnt_of_queries(self, get_items):
+        """
+        Return count of queries run by calling `get_items` and count of items
+        returned by it
+        """
+        statements = list()
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # objects of earlier calls must be loaded again
+        db.session.expunge_all()
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            items = get_items()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        return len(statements), len(items)
+
+    def get_reports(self):
+        cache.clear()
+        response = self.client.get('/api/reports')
+        self.assert200(response)
+        return json.loads(response.data)
+
+    def get_serialized_member_reports(self):
+        hub_plans = get_all_hub_plans_of_plan_type()
+        return [r.serialize() for r in
+                get_all_member_reports_of_hub_plans(hub_plans)]
+
+    def assert_query_count_is_flat(self, get_items):
+        self.create_member_reports(2)
+        cnt_of_queries, cnt_of_items = self.get_cnt_of_queries(get_items)
+        self.assertEqual(cnt_of_items, 6)
+
+        # ten times as many hub plans and member reports
+        self.create_member_reports(18)
+        cnt_of_more_queries, cnt_of_more_items = \
+            self.get_cnt_of_queries(get_items)
+        self.assertEqual(cnt_of_more_items, 60)
+
+        self.assertEqual(cnt_of_more_queries, cnt_of_queries)
+
+    def test_query_count_of_api_is_flat_as_member_reports_grow(self):
+        self.assert_query_count_is_flat(self.get_reports)
+
+    def test_query_count_of_serializing_is_flat_as_member_reports_grow(self):
+        self.assert_query_count_is_flat(self.get_serialized_member_reports)
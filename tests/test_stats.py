@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import date
+from app.models import Location, Hub, Plan, HubPlan
+from app.stats import (get_daily_stats_of_hub,
+                       iter_daily_stats_of_hub,
+                       save_hub_daily_stats)
+from tests.base import BaseTestCase
+from tests.test_reports import create_membership
+
+
+class DailyStatsTestCase(BaseTestCase):
+    """
+    Daily stats counted by a query and by binary search over dates of
+    memberships must be same, and saved daily stats are served as they are
+    """
+
+    def setUp(self):
+        super(DailyStatsTestCase, self).setUp()
+
+        self.hub = Hub(name='hub', location=Location(name='Delhi'))
+        hub_plan = HubPlan(hub=self.hub,
+                           plan=Plan(name='Full Time', price=5000))
+
+        # membership confirmed after first day
+        create_membership(self.hub, '1', [
+            (hub_plan, date(2015, 1, 10), None)])
+
+        # membership canceled on last day of a month
+        create_membership(self.hub, '2', [
+            (hub_plan, date(2014, 12, 1), date(2014, 12, 31))],
+            canceled_to=date(2014, 12, 31))
+
+    def get_counts(self, stats):
+        return (stats['active_count'], stats['new_count'],
+                stats['leave_count'])
+
+    def test_membership_confirmed_later_is_not_active(self):
+        stats = get_daily_stats_of_hub(self.hub, date(2014, 12, 30))
+        self.assertEqual(self.get_counts(stats), (1, 0, 0))
+
+    def test_counts_on_boundaries_of_memberships(self):
+        expected = {
+            date(2014, 12, 31): (1, 0, 1),
+            date(2015, 1, 1): (0, 0, 0),
+            date(2015, 1, 9): (0, 0, 0),
+            date(2015, 1, 10): (1, 1, 0),
+        }
+        for c_date, counts in expected.items():
+            stats = get_daily_stats_of_hub(self.hub, c_date)
+            self.assertEqual(self.get_counts(stats), counts)
+
+    def test_counts_same_as_of_query_of_each_day(self):
+        for stats in iter_daily_stats_of_hub(self.hub, date(2014, 11, 25),
+                                             date(2015, 1, 15)):
+            self.assertEqual(stats,
+                             get_daily_stats_of_hub(self.hub, stats['date']))
+
+    def test_daily_stats_are_read_from_saved_stats(self):
+        save_hub_daily_stats(list(iter_daily_stats_of_hub(
+            self.hub, date(2014, 12, 30), date(2015, 1, 10))))
+
+        response = self.client.get('/api/daily_stats?from=2014-12-31'
+                                   '&to=2015-01-10&hub_name=hub')
+        self.assert200(response)
+
+        stats = json.loads(response.data)
+        self.assertEqual(len(stats), 11)
+        self.assertEqual(stats[0], {'date': '2014-12-31', 'active_count': 1,
+                                    'new_count': 0, 'leave_count': 1})
+        self.assertEqual(stats[-1], {'date': '2015-01-10', 'active_count': 1,
+                                     'new_count': 1, 'leave_count': 0})
+
+    def test_daily_stats_of_invalid_date(self):
+        response = self.client.get('/api/daily_stats?from=2014-12')
+        self.assert400(response)